@@ -14,10 +14,11 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path
+from django.urls import include, path
 from vouchers.admin import VoucherAdmin, GenerateVouchersAdminView
 
 urlpatterns = [
     path('site-admin/', admin.site.urls),
+    path('api/vouchers/', include('vouchers.urls')),
 	path('', GenerateVouchersAdminView.as_view(), name='generate_vouchers'),
 ]
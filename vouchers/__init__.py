@@ -1 +1,3 @@
 __version__ = '1.2.0a3'
+
+default_app_config = 'vouchers.apps.VouchersConfig'
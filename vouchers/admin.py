@@ -1,10 +1,29 @@
 from django.conf.urls import url
 from django.contrib import admin
 from django.contrib import messages
+from django.http import Http404
+from django.shortcuts import get_object_or_404, redirect
+from django.db.models import BooleanField, Case, Count, F, Q, When
+from django.urls import reverse
+from django.utils.html import format_html
 from django.utils.translation import ugettext_lazy as _
 from django.views.generic.base import TemplateView
+from .exports import CONTENT_TYPES, export_response, iterate_batches
 from .forms import VoucherGenerationForm
-from .models import Voucher, VoucherUser, Campaign
+from .models import (
+    ArchivedVoucher, ArchivedVoucherUser, Campaign, GenerationJob, Voucher, VoucherUser, count_voucher_users,
+    status_conditions,
+)
+from .profiling import profiled, sinks
+from .settings import BACKGROUND_THRESHOLD, BULK_BATCH_SIZE
+
+def rendered(response):
+    """ Renders template responses right away while views are profiled, so the profile includes the queries of the
+    template. Otherwise they are left to be rendered after the template response middleware.
+    """
+    if sinks and hasattr(response, 'render'):
+        return response.render()
+    return response
 
 class VoucherUserInline(admin.TabularInline):
     model = VoucherUser
@@ -15,18 +34,69 @@ class VoucherUserInline(admin.TabularInline):
             return obj.user_limit
         return None  # disable limit for new objects (e.g. admin add)
 
+    def get_queryset(self, request):
+        # the rows are labelled with their user
+        return super(VoucherUserInline, self).get_queryset(request).select_related('user')
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        field = super(VoucherUserInline, self).formfield_for_foreignkey(db_field, request, **kwargs)
+        if db_field.name == 'user':
+            # the formset is built several times per request and every row renders the same choices, so the users
+            # are read once per request, iter() skips the count query of len()
+            if not hasattr(request, '_voucher_user_choices'):
+                request._voucher_user_choices = list(iter(field.choices))
+            field.choices = request._voucher_user_choices
+        return field
+
+class StatusListFilter(admin.SimpleListFilter):
+    title = _("status")
+    parameter_name = 'status'
+
+    def lookups(self, request, model_admin):
+        return Voucher.STATUSES
+
+    def queryset(self, request, queryset):
+        if self.value() in dict(Voucher.STATUSES):
+            return queryset.filter(status_conditions()[self.value()])
+        return queryset
+
 class VoucherAdmin(admin.ModelAdmin):
     list_display = [
         'created_at', 'code', 'type', 'value', 'user_count', 'user_limit', 'is_redeemed', 'valid_until', 'campaign'
     ]
-    list_filter = ['type', 'campaign', 'created_at', 'valid_until']
+    list_filter = [StatusListFilter, 'type', 'campaign', 'created_at', 'valid_until']
     raw_id_fields = ()
     search_fields = ('code', 'value')
     inlines = (VoucherUserInline,)
     exclude = ('users',)
 
+    def get_queryset(self, request):
+        return super(VoucherAdmin, self).get_queryset(request).select_related('campaign').annotate(
+            num_users=count_voucher_users(),
+            exhausted=Case(
+                When(user_limit=0, then=False),
+                When(redeemed_count__gte=F('user_limit'), then=True),
+                default=False,
+                output_field=BooleanField(),
+            ),
+        )
+
     def user_count(self, inst):
-        return inst.users.count()
+        return inst.num_users
+    user_count.admin_order_field = 'num_users'
+
+    def is_redeemed(self, inst):
+        return inst.is_redeemed
+    is_redeemed.admin_order_field = 'exhausted'
+    is_redeemed.boolean = True
+
+    @profiled('admin.voucher_changelist')
+    def changelist_view(self, request, extra_context=None):
+        return rendered(super(VoucherAdmin, self).changelist_view(request, extra_context))
+
+    def save_related(self, request, form, formsets, change):
+        super(VoucherAdmin, self).save_related(request, form, formsets, change)
+        form.instance.update_counters()  # the inline may have changed the voucher users
 
     def get_urls(self):
         urls = super(VoucherAdmin, self).get_urls()
@@ -42,45 +112,152 @@ class GenerateVouchersAdminView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super(GenerateVouchersAdminView, self).get_context_data(**kwargs)
-        if self.request.method == 'POST':
-            form = VoucherGenerationForm(self.request.POST)
-            if form.is_valid():
-                context['vouchers'] = Voucher.objects.create_vouchers(
-                    form.cleaned_data['quantity'],
-                    form.cleaned_data['type'],
-                    form.cleaned_data['value'],
-                    form.cleaned_data['valid_until'],
-                    form.cleaned_data['prefix'],
-                    form.cleaned_data['campaign'],
-                )
-                messages.success(self.request, _("Your vouchers have been generated."))
-        else:
-            form = VoucherGenerationForm()
-        context['form'] = form
+        context.setdefault('form', VoucherGenerationForm())
         return context
 
+    @profiled('admin.generate_vouchers')
     def post(self, request, *args, **kwargs):
-        context = self.get_context_data(**kwargs)
-        return self.render_to_response(context)
+        return rendered(self.generate(request, *args, **kwargs))
+
+    def generate(self, request, *args, **kwargs):
+        form = VoucherGenerationForm(request.POST)
+        if not form.is_valid():
+            return self.render_to_response(self.get_context_data(form=form, **kwargs))
+        if form.cleaned_data['quantity'] >= BACKGROUND_THRESHOLD and form.cleaned_data['output'] not in CONTENT_TYPES:
+            # too large to render in a web request, the ``process_voucher_jobs`` command picks the job up. Requested
+            # downloads are streamed batch by batch whatever the quantity
+            job = GenerationJob.objects.create(
+                quantity=form.cleaned_data['quantity'],
+                type=form.cleaned_data['type'],
+                value=form.cleaned_data['value'],
+                valid_until=form.cleaned_data['valid_until'],
+                prefix=form.cleaned_data['prefix'],
+                campaign=form.cleaned_data['campaign'],
+            )
+            messages.info(self.request, _("Your vouchers will be generated in the background."))
+            return redirect('admin:vouchers_generationjob_progress', job.pk)
+        arguments = (
+            form.cleaned_data['quantity'],
+            form.cleaned_data['type'],
+            form.cleaned_data['value'],
+            form.cleaned_data['valid_until'],
+            form.cleaned_data['prefix'],
+            form.cleaned_data['campaign'],
+        )
+        if form.cleaned_data['output'] in CONTENT_TYPES:
+            # every batch is committed and written to the response before the next one is generated, after the profile
+            batches = Voucher.objects.create_voucher_batches(*arguments)
+            return export_response(batches, form.cleaned_data['output'], 'vouchers')
+        vouchers = Voucher.objects.create_vouchers(*arguments, bulk=True)
+        messages.success(self.request, _("Your vouchers have been generated."))
+        return self.render_to_response(self.get_context_data(form=form, vouchers=vouchers, **kwargs))
 
 class CampaignAdmin(admin.ModelAdmin):
-    list_display = ['name', 'num_vouchers', 'num_vouchers_used', 'num_vouchers_unused', 'num_vouchers_expired']
+    list_display = [
+        'name', 'num_vouchers', 'num_vouchers_used', 'num_vouchers_unused', 'num_vouchers_exhausted',
+        'num_vouchers_expired'
+    ]
+
+    def get_queryset(self, request):
+        statuses = status_conditions('vouchers__')
+        return super(CampaignAdmin, self).get_queryset(request).annotate(
+            vouchers_count=Count('vouchers'),
+            used_count=Count('vouchers', filter=Q(vouchers__redeemed_count__gt=0)),
+            unused_count=Count('vouchers', filter=Q(vouchers__redeemed_count=0)),
+            exhausted_count=Count('vouchers', filter=statuses[Voucher.EXHAUSTED]),
+            expired_count=Count('vouchers', filter=statuses[Voucher.EXPIRED]),
+        )
+
+    @profiled('admin.campaign_changelist')
+    def changelist_view(self, request, extra_context=None):
+        return rendered(super(CampaignAdmin, self).changelist_view(request, extra_context))
 
     def num_vouchers(self, obj):
-        return obj.vouchers.count()
+        return obj.vouchers_count
     num_vouchers.short_description = _("vouchers")
+    num_vouchers.admin_order_field = 'vouchers_count'
 
     def num_vouchers_used(self, obj):
-        return obj.vouchers.used().count()
+        return obj.used_count
     num_vouchers_used.short_description = _("used")
+    num_vouchers_used.admin_order_field = 'used_count'
 
     def num_vouchers_unused(self, obj):
-        return obj.vouchers.used().count()
+        return obj.unused_count
     num_vouchers_unused.short_description = _("unused")
+    num_vouchers_unused.admin_order_field = 'unused_count'
+
+    def num_vouchers_exhausted(self, obj):
+        return obj.exhausted_count
+    num_vouchers_exhausted.short_description = _("exhausted")
+    num_vouchers_exhausted.admin_order_field = 'exhausted_count'
 
     def num_vouchers_expired(self, obj):
-        return obj.vouchers.expired().count()
+        return obj.expired_count
     num_vouchers_expired.short_description = _("expired")
+    num_vouchers_expired.admin_order_field = 'expired_count'
+
+class GenerationJobAdmin(admin.ModelAdmin):
+    list_display = ['created_at', 'quantity', 'type', 'value', 'campaign', 'status', 'generated', 'progress']
+    list_filter = ['status', 'created_at']
+    list_select_related = ('campaign',)
+    readonly_fields = ['status', 'generated', 'error', 'started_at', 'finished_at']
+
+    def has_add_permission(self, request):
+        return False  # jobs are created by the generate vouchers view
+
+    def progress(self, obj):
+        return format_html('<a href="{}">{}</a>',
+                           reverse('admin:vouchers_generationjob_progress', args=[obj.pk]), _("Progress"))
+    progress.short_description = _("progress")
+
+    def get_urls(self):
+        urls = super(GenerationJobAdmin, self).get_urls()
+        my_urls = [
+            url(r'^(\d+)/progress/$', self.admin_site.admin_view(GenerationJobProgressAdminView.as_view()),
+                name='vouchers_generationjob_progress'),
+            url(r'^(\d+)/download/(csv|ndjson)/$', self.admin_site.admin_view(self.download),
+                name='vouchers_generationjob_download'),
+        ]
+        return my_urls + urls
+
+    def download(self, request, pk, format):
+        job = get_object_or_404(GenerationJob, pk=pk)
+        if job.status != GenerationJob.DONE:
+            raise Http404(_("The vouchers of this job are not generated yet."))
+        batches = iterate_batches(job.vouchers.select_related('campaign'), BULK_BATCH_SIZE)
+        return export_response(batches, format, 'vouchers-%s' % job.pk)
+
+class GenerationJobProgressAdminView(TemplateView):
+    template_name = 'site-admin/generation_job.html'
+    refresh = 2  # seconds between the reloads of an unfinished job
+
+    def get_context_data(self, **kwargs):
+        context = super(GenerationJobProgressAdminView, self).get_context_data(**kwargs)
+        job = get_object_or_404(GenerationJob, pk=self.args[0])
+        context.update({
+            'job': job,
+            'percent': 100 * job.generated // job.quantity if job.quantity else 100,
+            'refresh': None if job.finished else self.refresh,
+        })
+        return context
+
+class ArchivedVoucherUserInline(admin.TabularInline):
+    model = ArchivedVoucherUser
+    extra = 0
+    raw_id_fields = ('user',)
+
+class ArchivedVoucherAdmin(admin.ModelAdmin):
+    list_display = ['code', 'type', 'value', 'status', 'redeemed_count', 'valid_until', 'campaign', 'archived_at']
+    list_filter = ['status', 'type', 'campaign', 'archived_at']
+    list_select_related = ('campaign',)
+    search_fields = ('code',)
+    inlines = (ArchivedVoucherUserInline,)
+
+    def has_add_permission(self, request):
+        return False  # vouchers are archived by the ``archive_vouchers`` command
 
 admin.site.register(Voucher, VoucherAdmin)
 admin.site.register(Campaign, CampaignAdmin)
+admin.site.register(GenerationJob, GenerationJobAdmin)
+admin.site.register(ArchivedVoucher, ArchivedVoucherAdmin)
@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+from django.utils.translation import ugettext_lazy as _
+
+
+class VouchersConfig(AppConfig):
+    name = 'vouchers'
+    verbose_name = _("Vouchers")
+
+    def ready(self):
+        from . import cache  # noqa: F401 connects the invalidation receivers
+        from . import metrics
+        from .models import vouchers_redeemed
+
+        vouchers_redeemed.connect(metrics.count_redemptions, dispatch_uid='vouchers.metrics.count_redemptions')
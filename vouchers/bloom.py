@@ -0,0 +1,198 @@
+import hashlib
+import math
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+
+from django.core.cache import caches
+from django.db import transaction
+
+from .settings import (
+    CACHE_ALIAS,
+    CODE_FILTER,
+    CODE_FILTER_PATH,
+    CODE_FILTER_CAPACITY,
+    CODE_FILTER_ERROR_RATE,
+)
+
+try:
+    import fcntl
+except ImportError:  # not available on windows, where only the cache storage works
+    fcntl = None
+
+HEADER = struct.Struct('>QB')
+CACHE_KEY = 'vouchers:code-filter'
+
+
+class BloomFilter(object):
+    """ A set of codes without false negatives, which answers with a false positive at ``error_rate``. """
+
+    def __init__(self, capacity=CODE_FILTER_CAPACITY, error_rate=CODE_FILTER_ERROR_RATE, size=None, hashes=None,
+                 bits=None):
+        if size is None:
+            size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+            hashes = max(1, int(round(size / capacity * math.log(2))))
+        self.size = size
+        self.hashes = hashes
+        self.bits = bytearray((size + 7) // 8) if bits is None else bytearray(bits)
+
+    def _indexes(self, code):
+        digest = hashlib.blake2b(code.encode('utf-8'), digest_size=16).digest()
+        first, second = struct.unpack('>QQ', digest)
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, code):
+        for i in self._indexes(code):
+            self.bits[i >> 3] |= 1 << (i & 7)
+
+    def update(self, codes):
+        for code in codes:
+            self.add(code)
+
+    def __contains__(self, code):
+        return all(self.bits[i >> 3] & (1 << (i & 7)) for i in self._indexes(code))
+
+    def union(self, other):
+        if (self.size, self.hashes) != (other.size, other.hashes):
+            raise ValueError("Only filters of the same size can be merged.")
+        bits = int.from_bytes(self.bits, 'big') | int.from_bytes(other.bits, 'big')
+        self.bits = bytearray(bits.to_bytes(len(self.bits), 'big'))
+
+    def to_bytes(self):
+        return HEADER.pack(self.size, self.hashes) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data):
+        size, hashes = HEADER.unpack_from(data)
+        return cls(size=size, hashes=hashes, bits=data[HEADER.size:])
+
+
+_loaded = {'version': None, 'filter': None}
+_lock = threading.Lock()
+_pending = threading.local()  # codes waiting for the commit, by database alias
+
+
+def get_filter():
+    """ Returns the stored filter or ``None``, reloading the local copy only when the stored one has changed. """
+    if not CODE_FILTER:
+        return None
+    version = _version()
+    with _lock:
+        if version != _loaded['version']:
+            data = _read()
+            _loaded['filter'] = BloomFilter.from_bytes(data) if data else None
+            _loaded['version'] = version
+        return _loaded['filter']
+
+
+def might_exist(code):
+    bloom = get_filter()
+    return bloom is None or code in bloom
+
+
+def add_codes(codes):
+    """ Adds new codes to the stored filter. Nothing happens before the filter has been built.
+
+    A stored filter is kept up to date even while ``VOUCHERS_CODE_FILTER`` is off, so it can be built before it is
+    turned on without missing the codes created in between.
+    """
+    if not codes or _version() is None:
+        return
+    with _storage_lock():
+        data = _read()
+        if data:
+            bloom = BloomFilter.from_bytes(data)
+            bloom.update(codes)
+            _write(bloom.to_bytes())
+
+
+def add_codes_on_commit(codes, using=None):
+    """ Adds ``codes`` once the current transaction is committed, rewriting the stored filter once per transaction. """
+    if not codes:
+        return
+    connection = transaction.get_connection(using)
+    pending = _pending.__dict__.setdefault(connection.alias, [])
+    scheduled = any(getattr(entry[1], 'func', None) is _add_pending for entry in connection.run_on_commit)
+    pending.extend(codes)
+    if not scheduled:
+        # a rollback drops the callback but not the codes, which are harmless false positives then
+        transaction.on_commit(partial(_add_pending, connection.alias), using)
+
+
+def _add_pending(alias):
+    add_codes(_pending.__dict__.pop(alias, []))
+
+
+def store(bloom):
+    """ Replaces the stored filter, keeping codes which were added to it concurrently if both have the same size. """
+    with _storage_lock():
+        data = _read()
+        if data:
+            try:
+                bloom.union(BloomFilter.from_bytes(data))
+            except ValueError:
+                pass
+        _write(bloom.to_bytes())
+
+
+def _cache():
+    return caches[CACHE_ALIAS or 'default']
+
+
+def _version():
+    if CODE_FILTER_PATH is None:
+        return _cache().get(CACHE_KEY + ':version')
+    try:
+        stat = os.stat(CODE_FILTER_PATH)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def _read():
+    if CODE_FILTER_PATH is None:
+        return _cache().get(CACHE_KEY)
+    try:
+        with open(CODE_FILTER_PATH, 'rb') as f:
+            return f.read()
+    except IOError:
+        return None
+
+
+def _write(data):
+    if CODE_FILTER_PATH is None:
+        # the version is written last, so a reader seeing it always gets this filter or a newer one
+        _cache().set(CACHE_KEY, data, None)
+        _cache().set(CACHE_KEY + ':version', os.urandom(8), None)
+        return
+    temporary = '%s.%d.tmp' % (CODE_FILTER_PATH, os.getpid())
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, CODE_FILTER_PATH)  # readers never see a partial file
+
+
+@contextmanager
+def _storage_lock(timeout=30):
+    if CODE_FILTER_PATH is not None and fcntl is not None:
+        with open(CODE_FILTER_PATH + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return
+    # the token tells the lock of this writer apart from one taken by another writer after it expired
+    token = os.urandom(16)
+    deadline = time.time() + timeout
+    while not _cache().add(CACHE_KEY + ':lock', token, timeout):
+        if time.time() >= deadline:
+            raise TimeoutError("The code filter is locked by another writer.")
+        time.sleep(0.01)
+    try:
+        yield
+    finally:
+        if _cache().get(CACHE_KEY + ':lock') == token:
+            _cache().delete(CACHE_KEY + ':lock')
@@ -0,0 +1,142 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Voucher, VoucherUser, vouchers_redeemed
+from .settings import (
+    CACHE_ALIAS,
+    CACHE_TIMEOUT,
+    LOCAL_CACHE_SIZE,
+    LOCAL_CACHE_TIMEOUT,
+)
+
+_local = OrderedDict()
+_lock = threading.Lock()
+_stats = dict.fromkeys(('local_hits', 'hits', 'misses', 'invalidations'), 0)
+
+
+def get_voucher(code):
+    """ Returns the voucher with ``code`` or ``None``, reading through the local LRU and the Django cache.
+
+    Cached vouchers are rebuilt from a tuple of their column values and can be saved and redeemed as usual.
+    """
+    if CACHE_ALIAS is None:
+        return _load(code)
+    key = _key(code)
+    values = _local_get(key)
+    if values is not None:
+        _count('local_hits')
+    else:
+        values = caches[CACHE_ALIAS].get(key)
+        if values is not None:
+            _count('hits')
+        else:
+            _count('misses')
+            voucher = _load(code)
+            if voucher is None:
+                return None
+            values = tuple(getattr(voucher, name) for name in _field_names())
+            caches[CACHE_ALIAS].set(key, values, CACHE_TIMEOUT)
+        _local_set(key, values)
+    return Voucher.from_db(DEFAULT_DB_ALIAS, _field_names(), values)
+
+
+def invalidate(*codes):
+    codes = [code for code in codes if code]
+    if CACHE_ALIAS is None or not codes:
+        return
+    keys = [_key(code) for code in codes]
+    caches[CACHE_ALIAS].delete_many(keys)
+    with _lock:
+        for key in keys:
+            _local.pop(key, None)
+    _count('invalidations', len(keys))
+
+
+def stats():
+    """ Returns the hit and miss counts of this process. """
+    with _lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    with _lock:
+        _stats.update(dict.fromkeys(_stats, 0))
+
+
+def clear_local():
+    with _lock:
+        _local.clear()
+
+
+@receiver(post_save, sender=Voucher)
+@receiver(post_delete, sender=Voucher)
+def invalidate_voucher(sender, instance, **kwargs):
+    # a renamed voucher must not stay reachable by its former code
+    invalidate(instance.code, getattr(instance, '_loaded_code', None))
+
+
+@receiver(post_save, sender=VoucherUser)
+@receiver(post_delete, sender=VoucherUser)
+def invalidate_voucher_user(sender, instance, **kwargs):
+    if CACHE_ALIAS is None:
+        return
+    if VoucherUser.voucher.is_cached(instance):
+        invalidate(instance.voucher.code)
+    else:
+        invalidate(*Voucher.objects.filter(pk=instance.voucher_id).values_list('code', flat=True))
+
+
+@receiver(vouchers_redeemed)
+def invalidate_redeemed(sender, vouchers, **kwargs):
+    invalidate(*[voucher.code for voucher in vouchers])
+
+
+def _load(code):
+    try:
+        return Voucher.objects.get(code=code)
+    except Voucher.DoesNotExist:
+        return None
+
+
+def _key(code):
+    return 'vouchers:code:%s' % hashlib.sha1(code.encode('utf-8')).hexdigest()
+
+
+def _field_names():
+    return [field.attname for field in Voucher._meta.concrete_fields]
+
+
+def _count(name, value=1):
+    with _lock:
+        _stats[name] += value
+
+
+def _local_get(key):
+    if not LOCAL_CACHE_SIZE:
+        return None
+    with _lock:
+        entry = _local.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del _local[key]
+            return None
+        _local.move_to_end(key)
+        return entry[1]
+
+
+def _local_set(key, values):
+    if not LOCAL_CACHE_SIZE:
+        return
+    with _lock:
+        _local[key] = (time.monotonic() + LOCAL_CACHE_TIMEOUT, values)
+        _local.move_to_end(key)
+        while len(_local) > LOCAL_CACHE_SIZE:
+            _local.popitem(last=False)
@@ -0,0 +1,176 @@
+import hashlib
+import os
+import secrets
+from functools import lru_cache
+
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.encoding import force_bytes
+
+from .settings import (
+    CODE_LENGTH,
+    CODE_CHARS,
+    SEGMENTED_CODES,
+    SEGMENT_LENGTH,
+    SEGMENT_SEPARATOR,
+    SIGNED_CODES,
+    SIGNING_KEY,
+    SIGNATURE_LENGTH,
+    SIGNATURE_SEPARATOR,
+    ACCEPT_UNSIGNED_CODES,
+)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def random_strings(count, length=CODE_LENGTH, chars=CODE_CHARS):
+    """ Returns ``count`` distinct strings of ``length`` characters drawn uniformly from ``chars``. """
+    if count > len(chars) ** length:
+        raise ValueError("Cannot generate %d distinct codes of length %d." % (count, length))
+    strings = dict.fromkeys(_random_strings(count, length, chars))
+    while len(strings) < count:  # regenerate only the duplicates
+        strings.update(dict.fromkeys(_random_strings(count - len(strings), length, chars)))
+    return list(strings)
+
+
+def segment(code, length=SEGMENT_LENGTH, separator=SEGMENT_SEPARATOR):
+    return separator.join([code[i:i + length] for i in range(0, len(code), length)])
+
+
+def signature(code, key=SIGNING_KEY, chars=CODE_CHARS):
+    """ Returns the first ``SIGNATURE_LENGTH`` base-N digits of the HMAC of ``code``.
+
+    The digest is read as one number, so every character is uniformly distributed, unlike a digest byte modulo N.
+    """
+    number = int.from_bytes(salted_hmac("vouchers.codes.signature", code, key).digest(), 'big')
+    digits = []
+    for i in range(SIGNATURE_LENGTH):
+        number, digit = divmod(number, len(chars))
+        digits.append(chars[digit])
+    return "".join(digits)
+
+
+def code_length(prefix="", segmented=SEGMENTED_CODES):
+    """ Returns the length of the codes generated with ``prefix``, including segment separators and signature. """
+    length = len(prefix) + CODE_LENGTH
+    if segmented:
+        length += (CODE_LENGTH - 1) // SEGMENT_LENGTH * len(SEGMENT_SEPARATOR)
+    if SIGNED_CODES:
+        length += len(SIGNATURE_SEPARATOR) + SIGNATURE_LENGTH
+    return length
+
+
+def sign(code):
+    return code + SIGNATURE_SEPARATOR + signature(code)
+
+
+def is_signed(code):
+    return len(code) > SIGNATURE_LENGTH and code[-SIGNATURE_LENGTH - 1] == SIGNATURE_SEPARATOR
+
+
+def is_acceptable(code):
+    """ Returns false for codes which cannot exist, without touching the database. """
+    if not SIGNED_CODES:
+        return True
+    if is_signed(code):
+        return constant_time_compare(code[-SIGNATURE_LENGTH:], signature(code[:-SIGNATURE_LENGTH - 1]))
+    return ACCEPT_UNSIGNED_CODES
+
+
+def _random_strings(count, length, chars):
+    if len(chars) > 256:
+        return ["".join(secrets.choice(chars) for i in range(length)) for j in range(count)]
+    if max(chars) > "\xff" and numpy is not None:
+        return _random_strings_numpy(count, length, chars)
+    data = _random_bytes(count * length, len(chars))
+    if max(chars) <= "\xff":
+        # maps all bytes at once in C, which is faster than numpy for latin-1 alphabets
+        data = data.translate(_byte_table(chars)).decode('latin-1')
+    else:
+        data = "".join(chars[i % len(chars)] for i in data)
+    return [data[i:i + length] for i in range(0, count * length, length)]
+
+
+@lru_cache()
+def _byte_table(chars):
+    return bytes(ord(chars[i % len(chars)]) for i in range(256))
+
+
+@lru_cache()
+def _rejected_bytes(base):
+    return bytes(range(256 - 256 % base, 256))
+
+
+def _random_bytes(size, base):
+    """ Returns ``size`` random bytes from ``os.urandom`` which are uniformly distributed modulo ``base``.
+
+    Bytes at or above the largest multiple of ``base`` are rejected to avoid a modulo bias.
+    """
+    rejected = _rejected_bytes(base)
+    data = b""
+    while len(data) < size:
+        data += os.urandom((size - len(data)) * 256 // (256 - len(rejected)) + 16).translate(None, rejected)
+    return data[:size]
+
+
+def _random_strings_numpy(count, length, chars):
+    limit = 256 - 256 % len(chars)
+    indexes = numpy.empty(0, dtype=numpy.uint8)
+    while len(indexes) < count * length:
+        missing = count * length - len(indexes)
+        data = numpy.frombuffer(os.urandom(missing * 256 // limit + 16), dtype=numpy.uint8)
+        indexes = numpy.concatenate((indexes, data[data < limit]))
+    indexes = (indexes[:count * length] % len(chars)).reshape(count, length)
+    alphabet = numpy.array(list(chars), dtype='U1')
+    # every row of single characters is reinterpreted as one string of ``length`` characters
+    return numpy.ascontiguousarray(alphabet[indexes]).view('U%d' % length).ravel().tolist()
+
+
+class Permutation(object):
+    """ A keyed permutation of all ``len(chars) ** length`` codes.
+
+    The number is split into two base-N halves which are mixed in an unbalanced Feistel network, so every number
+    below ``len(chars) ** length`` maps to a distinct code and the mapping cannot be reversed without the key.
+    """
+    rounds = 8
+
+    def __init__(self, key, length=CODE_LENGTH, chars=CODE_CHARS):
+        self.key = hashlib.sha256(force_bytes(key)).digest()
+        self.length = length
+        self.chars = chars
+        self.left_size = len(chars) ** (length // 2)
+        self.right_size = len(chars) ** (length - length // 2)
+
+    def _round(self, i, value):
+        digest = hashlib.blake2b(b"%d:%d" % (i, value), key=self.key, digest_size=16).digest()
+        return int.from_bytes(digest, 'big')
+
+    def encrypt(self, number):
+        left, right = divmod(number, self.right_size)
+        for i in range(self.rounds):
+            if i % 2:
+                left = (left + self._round(i, right)) % self.left_size
+            else:
+                right = (right + self._round(i, left)) % self.right_size
+        return left * self.right_size + right
+
+    def decrypt(self, number):
+        left, right = divmod(number, self.right_size)
+        for i in reversed(range(self.rounds)):
+            if i % 2:
+                left = (left - self._round(i, right)) % self.left_size
+            else:
+                right = (right - self._round(i, left)) % self.right_size
+        return left * self.right_size + right
+
+    def code(self, number):
+        if not 0 <= number < self.left_size * self.right_size:
+            raise ValueError("The code space of %d codes is exhausted." % (self.left_size * self.right_size))
+        number = self.encrypt(number)
+        code = []
+        for i in range(self.length):
+            number, digit = divmod(number, len(self.chars))
+            code.append(self.chars[digit])
+        return "".join(reversed(code))
@@ -0,0 +1,60 @@
+import csv
+import json
+
+from django.http import StreamingHttpResponse
+
+EXPORT_FIELDS = ('id', 'code', 'campaign', 'valid_until')
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class Echo(object):
+    """ A file-like object which hands written rows back to the csv writer's caller. """
+
+    def write(self, value):
+        return value
+
+
+def iterate_batches(queryset, size):
+    """ Yields the rows of ``queryset`` in primary key order, fetching ``size`` rows per query. """
+    last = None
+    while True:
+        batch = queryset.order_by('pk')
+        if last is not None:
+            batch = batch.filter(pk__gt=last)
+        batch = list(batch[:size])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1].pk
+
+
+def export_row(voucher):
+    return (
+        voucher.pk,
+        voucher.code,
+        str(voucher.campaign) if voucher.campaign_id else "",
+        voucher.valid_until.isoformat() if voucher.valid_until else "",
+    )
+
+
+def csv_lines(batches):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for batch in batches:
+        yield "".join(writer.writerow(export_row(voucher)) for voucher in batch)
+
+
+def ndjson_lines(batches):
+    for batch in batches:
+        yield "".join(json.dumps(dict(zip(EXPORT_FIELDS, export_row(voucher)))) + "\n" for voucher in batch)
+
+
+def export_response(batches, format, filename):
+    """ Streams batches of vouchers as ``csv`` or ``ndjson``, so only one batch is held in memory at a time. """
+    lines = csv_lines(batches) if format == 'csv' else ndjson_lines(batches)
+    response = StreamingHttpResponse(lines, content_type=CONTENT_TYPES[format])
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (filename, format)
+    return response
@@ -1,7 +1,19 @@
 from django import forms
 from django.utils.translation import ugettext_lazy as _
-from .models import Voucher, VoucherUser, Campaign
-from .settings import VOUCHER_TYPES
+from . import metrics
+from .bloom import might_exist
+from .cache import get_voucher
+from .codes import code_length, is_acceptable
+from .models import Voucher, Campaign
+from .profiling import profiled
+from .settings import VOUCHER_TYPES, CACHE_ALIAS, ARCHIVE_LOOKUP
+from .validation import INVALID, archived_errors, count_outcome, voucher_error
+
+OUTPUT_FORMATS = (
+    ('html', _("Table")),
+    ('csv', _("CSV download")),
+    ('ndjson', _("NDJSON download")),
+)
 
 class VoucherGenerationForm(forms.Form):
     quantity = forms.IntegerField(label=_("Quantity"))
@@ -15,6 +27,21 @@ class VoucherGenerationForm(forms.Form):
     campaign = forms.ModelChoiceField(
         label=_("Campaign"), queryset=Campaign.objects.all(), required=False
     )
+    output = forms.ChoiceField(
+        label=_("Output"), choices=OUTPUT_FORMATS, required=False,
+        help_text=_("Note: Downloads are streamed while the vouchers are generated, large tables are generated in the "
+                    "background")
+    )
+
+    def clean_prefix(self):
+        prefix = self.cleaned_data['prefix']
+        max_length = Voucher._meta.get_field('code').max_length
+        if code_length(prefix) > max_length:
+            raise forms.ValidationError(
+                _("The prefix can be at most %(length)d characters long."),
+                params={'length': max(0, max_length - code_length())}
+            )
+        return prefix
 
 class VoucherForm(forms.Form):
     code = forms.CharField(label=_("Voucher code"))
@@ -30,37 +57,36 @@ class VoucherForm(forms.Form):
             del kwargs['types']
         super(VoucherForm, self).__init__(*args, **kwargs)
 
+    @metrics.timed('clean_code')
+    @profiled('clean_code')
     def clean_code(self):
         code = self.cleaned_data['code']
-        try:
-            voucher = Voucher.objects.get(code=code)
-        except Voucher.DoesNotExist:
-            raise forms.ValidationError(_("This code is not valid."))
-        self.voucher = voucher
-
-        if self.user is None and voucher.user_limit is not 1:
-            # vouchers with can be used only once can be used without tracking the user, otherwise there is no chance
-            # of excluding an unknown user from multiple usages.
-            raise forms.ValidationError(_(
-                "The server must provide an user to this form to allow you to use this code. Maybe you need to sign in?"
-            ))
+        error = self._code_error(code)
+        count_outcome(error)
+        if error is not None:
+            raise forms.ValidationError(error)
+        return code
 
-        if voucher.is_redeemed:
-            raise forms.ValidationError(_("This code has already been used."))
+    def _code_error(self, code):
+        if not is_acceptable(code) or not might_exist(code):
+            return INVALID
+        voucher = self._get_voucher(code)
+        if voucher is None and ARCHIVE_LOOKUP:
+            return archived_errors([code]).get(code, INVALID)
+        if voucher is not None:
+            self.voucher = voucher
+        return voucher_error(voucher, self.user, self.types)
 
-        try:  # check if there is a user bound voucher existing
-            user_voucher = voucher.users.get(user=self.user)
-            if user_voucher.redeemed_at is not None:
-                raise forms.ValidationError(_("This code has already been used by your account."))
-        except VoucherUser.DoesNotExist:
-            if voucher.user_limit is not 0:  # zero means no limit of user count
-                # only user bound vouchers left and you don't have one
-                if voucher.user_limit is voucher.users.filter(user__isnull=False).count():
-                    raise forms.ValidationError(_("This code is not valid for your account."))
-                if voucher.user_limit is voucher.users.filter(redeemed_at__isnull=False).count():  # all vouchers redeemed
-                    raise forms.ValidationError(_("This code has already been used."))
-        if self.types is not None and voucher.type not in self.types:
-            raise forms.ValidationError(_("This code is not meant to be used here."))
-        if voucher.expired():
-            raise forms.ValidationError(_("This code is expired."))
-        return code
+    def _get_voucher(self, code):
+        if CACHE_ALIAS is None:
+            try:
+                return Voucher.objects.with_user_state(self.user).get(code=code)
+            except Voucher.DoesNotExist:
+                return None
+        voucher = get_voucher(code)
+        if voucher is not None:
+            voucher.user_bound = voucher.user_redeemed = False
+            if voucher.bound_user_count:  # otherwise the user cannot be bound to it
+                for redeemed_at in voucher.users.filter(user=self.user).values_list('redeemed_at', flat=True)[:1]:
+                    voucher.user_bound, voucher.user_redeemed = True, redeemed_at is not None
+        return voucher
@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from vouchers.models import ArchivedVoucher, Voucher
+from vouchers.settings import ARCHIVE_AFTER_DAYS
+
+
+class Command(BaseCommand):
+    help = ("Moves exhausted vouchers and vouchers expired for a while with their users to the archive tables. "
+            "Every batch is its own transaction, so an interrupted run is resumed by running the command again.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS,
+                            help="Archive vouchers expired for at least this many days.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Number of vouchers per transaction.")
+        parser.add_argument('--limit', type=int, help="Stop after archiving about this many vouchers.")
+
+    def handle(self, *args, **options):
+        vouchers = Voucher.objects.with_status().filter(
+            Q(user_limit__gt=0, redeemed_count__gte=F('user_limit')) |
+            Q(valid_until__lt=timezone.now() - timedelta(days=options['days']))
+        ).order_by('pk')
+        archived = 0
+        while options['limit'] is None or archived < options['limit']:
+            with transaction.atomic():
+                # locked, so no voucher is redeemed while it is copied
+                batch = list(vouchers.select_for_update()[:options['batch_size']])
+                if not batch:
+                    break
+                archived += ArchivedVoucher.archive(batch)
+            self.stdout.write("Archived %d vouchers." % archived)
+        self.stdout.write("Done, %d vouchers archived." % archived)
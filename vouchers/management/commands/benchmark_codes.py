@@ -0,0 +1,31 @@
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from vouchers.models import Voucher
+from vouchers.settings import CODE_LENGTH, CODE_CHARS
+
+
+def legacy_generate_code(prefix=""):
+    """ The former per-code path of ``Voucher.generate_code``. """
+    return prefix + "".join(random.choice(CODE_CHARS) for i in range(CODE_LENGTH))
+
+
+class Command(BaseCommand):
+    help = "Compares the per-code voucher code generation with Voucher.generate_codes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100000, help="Number of codes per run.")
+        parser.add_argument('--repeat', type=int, default=3, help="Number of runs, the best one is reported.")
+
+    def handle(self, *args, **options):
+        count = options['count']
+        candidates = [
+            ("random.choice per code", lambda: [legacy_generate_code() for i in range(count)]),
+            ("Voucher.generate_code per code", lambda: [Voucher.generate_code() for i in range(count)]),
+            ("Voucher.generate_codes", lambda: Voucher.generate_codes(count)),
+        ]
+        for name, func in candidates:
+            seconds = min(timeit.repeat(func, number=1, repeat=options['repeat']))
+            self.stdout.write("%-40s %8.3fs %12.0f codes/s" % (name, seconds, count / seconds))
@@ -0,0 +1,125 @@
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from vouchers.forms import VoucherForm
+from vouchers.models import Campaign, Voucher
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ("Times voucher generation, validation, redemption and the admin changelists at growing table sizes in "
+            "a throwaway test database, and reports wall time, queries and peak memory as JSON. The peak memory is "
+            "traced in a second pass, so the times do not include the tracemalloc overhead.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000', help="Comma separated numbers of vouchers.")
+        parser.add_argument('--calls', type=int, default=200, help="Calls per operation and size.")
+        parser.add_argument('--output', help="File for the JSON report, printed when omitted.")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted(int(size) for size in options['sizes'].split(','))
+        except ValueError:
+            raise CommandError("--sizes must be comma separated numbers.")
+        if options['calls'] < 1:
+            raise CommandError("--calls must be at least 1.")
+        if sizes[0] < 3 * options['calls']:
+            # every call validates one unused code and redeems two others, one in each pass
+            raise CommandError("Every size must be at least 3 times --calls, %d is too small for %d calls." % (
+                sizes[0], options['calls']))
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = self.run(sizes, options['calls'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        report = json.dumps({
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'results': results,
+        }, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(report + "\n")
+        else:
+            self.stdout.write(report)
+
+    def run(self, sizes, calls):
+        campaign = Campaign.objects.create(name="benchmark")
+        User.objects.bulk_create([User(username="benchmark%d" % i) for i in range(calls)])
+        users = list(User.objects.filter(username__startswith="benchmark").order_by('pk'))
+        client = Client()
+        client.force_login(User.objects.create_superuser("admin", "admin@example.com", "admin"))
+        results = []
+        for size in sizes:
+            missing = size - Voucher.objects.count()
+            if missing > 0:
+                self.stderr.write("Filling the voucher table up to %d rows..." % size)
+                Voucher.objects.create_vouchers(missing, 'monetary', 100, campaign=campaign, bulk=True,
+                                                batch_size=5000)
+            codes = list(Voucher.objects.filter(redeemed_count=0).values_list('code', flat=True)[:3 * calls])
+            vouchers = list(Voucher.objects.filter(code__in=codes[calls:]))
+            operations = [
+                ('generate_code', lambda i: Voucher.generate_code()),
+                ('create_vouchers', lambda i: Voucher.objects.create_vouchers(10, 'monetary', 100, bulk=True)),
+                # both passes validate the same codes, the second pass redeems other vouchers
+                ('clean_code', lambda i: VoucherForm(
+                    data={'code': codes[i % calls]}, user=users[i % calls]).is_valid()),
+                ('redeem', lambda i: vouchers[i].redeem(users[i % calls])),
+                ('voucher_changelist', lambda i: client.get(reverse('admin:vouchers_voucher_changelist'))),
+                ('campaign_changelist', lambda i: client.get(reverse('admin:vouchers_campaign_changelist'))),
+            ]
+            for name, func in operations:
+                number = calls if name in ('generate_code', 'clean_code', 'redeem') else max(1, calls // 20)
+                result = dict(self.measure(func, number), operation=name, size=size)
+                self.stderr.write("%(size)9d %(operation)-20s %(per_call_ms)10.3f ms %(queries)6d queries "
+                                  "%(peak_memory_kb)10.1f KiB" % result)
+                results.append(result)
+        return results
+
+    def measure(self, func, number):
+        """ Calls ``func(i)`` ``number`` times and returns the wall time, query count and peak traced memory.
+
+        The memory is traced while calling ``func`` with the next ``number`` indexes, so the timed calls are not
+        slowed down by tracemalloc.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for i in range(number):
+                func(i)
+            seconds = time.perf_counter() - started
+        tracemalloc.start()
+        try:
+            for i in range(number, 2 * number):
+                func(i)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return {
+            'calls': number,
+            'seconds': seconds,
+            'per_call_ms': 1000 * seconds / number,
+            'queries': len(queries),
+            'queries_per_call': len(queries) / number,
+            'peak_memory_kb': peak / 1024,
+        }
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from vouchers.bloom import BloomFilter, add_codes, store
+from vouchers.models import ArchivedVoucher, Voucher
+from vouchers.settings import ARCHIVE_LOOKUP, CODE_FILTER_CAPACITY, CODE_FILTER_ERROR_RATE
+
+
+class Command(BaseCommand):
+    help = ("Builds the Bloom filter of all voucher codes. It can be built before VOUCHERS_CODE_FILTER is enabled, "
+            "new codes are added to a stored filter either way.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--capacity', type=int, help="Expected number of codes, defaults to the setting "
+                                                         "or twice the current number of codes.")
+        parser.add_argument('--error-rate', type=float, default=CODE_FILTER_ERROR_RATE)
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        last_pk = Voucher.objects.aggregate(last_pk=Max('pk'))['last_pk'] or 0
+        count = Voucher.objects.count()
+        if ARCHIVE_LOOKUP:
+            count += ArchivedVoucher.objects.count()
+        capacity = options['capacity'] or max(CODE_FILTER_CAPACITY, 2 * count)
+        bloom = BloomFilter(capacity, options['error_rate'])
+        codes = Voucher.objects.filter(pk__lte=last_pk).values_list('code', flat=True)
+        bloom.update(codes.iterator(chunk_size=options['chunk_size']))
+        if ARCHIVE_LOOKUP:
+            # archived codes are still told apart from invalid ones, so the filter must not reject them
+            archived = ArchivedVoucher.objects.values_list('code', flat=True)
+            bloom.update(archived.iterator(chunk_size=options['chunk_size']))
+        store(bloom)
+        # codes created meanwhile were only added to the former filter
+        add_codes(list(Voucher.objects.filter(pk__gt=last_pk).values_list('code', flat=True)))
+        self.stdout.write("Stored a filter of %d bytes for %d codes." % (len(bloom.bits), capacity))
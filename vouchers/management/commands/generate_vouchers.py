@@ -0,0 +1,77 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from vouchers.forms import VoucherGenerationForm
+from vouchers.management.workers import init_worker
+from vouchers.models import Voucher
+from vouchers.settings import BULK_BATCH_SIZE
+
+
+def generate_chunk(quantity, arguments, batch_size):
+    """ Generates ``quantity`` vouchers in committed batches and returns how many were created. """
+    batches = Voucher.objects.create_voucher_batches(quantity, batch_size=batch_size, **arguments)
+    return sum(len(batch) for batch in batches)
+
+
+class Command(BaseCommand):
+    help = "Generates vouchers in parallel worker processes, taking the arguments of the generate vouchers form."
+
+    def add_arguments(self, parser):
+        parser.add_argument('quantity', type=int)
+        parser.add_argument('type')
+        parser.add_argument('value', type=int)
+        parser.add_argument('--valid-until', help="Date and time as 'YYYY-MM-DD HH:MM'.")
+        parser.add_argument('--prefix', default="")
+        parser.add_argument('--campaign', type=int, help="Id of the campaign.")
+        parser.add_argument('--workers', type=int, default=4, help="Number of worker processes, 1 runs in-process.")
+        parser.add_argument('--chunk-size', type=int, default=100000, help="Number of vouchers per worker task.")
+        parser.add_argument('--batch-size', type=int, default=BULK_BATCH_SIZE,
+                            help="Number of vouchers per transaction.")
+
+    def handle(self, *args, **options):
+        data = {key: options[key] for key in ('quantity', 'type', 'value', 'prefix', 'campaign')}
+        if options['valid_until']:
+            data['valid_until_0'], _, data['valid_until_1'] = options['valid_until'].partition(" ")
+        form = VoucherGenerationForm(data)
+        if not form.is_valid():
+            raise CommandError("; ".join(
+                "%s: %s" % (field, " ".join(errors)) for field, errors in form.errors.items()))
+        arguments = {
+            'type': form.cleaned_data['type'],
+            'value': form.cleaned_data['value'],
+            'valid_until': form.cleaned_data['valid_until'],
+            'prefix': form.cleaned_data['prefix'],
+            'campaign': form.cleaned_data['campaign'],
+        }
+        quantity = form.cleaned_data['quantity']
+        chunk_size = options['chunk_size']
+        chunks = [min(chunk_size, quantity - start) for start in range(0, quantity, chunk_size)]
+
+        started = time.time()
+        created = 0
+        if options['workers'] <= 1:
+            for chunk in chunks:
+                created += generate_chunk(chunk, arguments, options['batch_size'])
+                self.report(created, quantity, started)
+        else:
+            # uniqueness needs no lock between the workers: sequence codes come from disjoint reserved blocks and
+            # random codes which collide with another worker are regenerated by ``create_voucher_batches``
+            connections.close_all()
+            with ProcessPoolExecutor(options['workers'], initializer=init_worker) as executor:
+                futures = [
+                    executor.submit(generate_chunk, chunk, arguments, options['batch_size'])
+                    for chunk in chunks
+                ]
+                for future in as_completed(futures):
+                    created += future.result()
+                    self.report(created, quantity, started)
+        seconds = time.time() - started
+        self.stdout.write("Generated %d vouchers in %.1fs (%.0f codes/s)." % (
+            created, seconds, created / seconds if seconds else 0))
+
+    def report(self, created, quantity, started):
+        seconds = time.time() - started
+        self.stdout.write("%d/%d vouchers, %.0f codes/s" % (created, quantity, created / seconds if seconds else 0))
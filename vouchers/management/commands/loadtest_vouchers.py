@@ -0,0 +1,158 @@
+import json
+import random
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, OperationalError, connections
+from django.db.models import F
+
+from vouchers.forms import VoucherForm
+from vouchers.management.workers import init_worker
+from vouchers.models import Voucher, VoucherUser, count_voucher_users
+
+OUTCOMES = ('redeemed', 'rejected', 'conflict', 'busy', 'error')
+
+
+def attempt(code, user):
+    """ Validates and redeems ``code`` like a checkout does and returns the outcome. """
+    form = VoucherForm(data={'code': code}, user=user)
+    if not form.is_valid():
+        return 'rejected'
+    # a valid code may still lose its last slot to a concurrent redemption
+    return 'redeemed' if form.voucher.redeem(user) else 'conflict'
+
+
+def run_worker(codes, users, deadline, seed):
+    """ Redeems random codes for random users until ``deadline``, returns the latencies, outcomes and errors. """
+    rng = random.Random(seed)
+    latencies = []
+    outcomes = Counter()
+    errors = Counter()
+    try:
+        while time.time() < deadline:
+            code = rng.choice(codes)
+            user = User(pk=rng.choice(users))  # only the key is used
+            started = time.perf_counter()
+            try:
+                outcome = attempt(code, user)
+            except OperationalError as e:  # locked or busy database, deadlocks and serialization failures
+                outcome = 'busy'
+                errors[str(e)] += 1
+            except DatabaseError as e:
+                outcome = 'error'
+                errors[str(e)] += 1
+            latencies.append(time.perf_counter() - started)
+            outcomes[outcome] += 1
+    finally:
+        connections.close_all()  # only the connections of this thread or process
+    return latencies, outcomes, errors
+
+
+def percentile(values, fraction):
+    """ Returns the nearest-rank percentile of the sorted ``values``. """
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Command(BaseCommand):
+    help = ("Validates and redeems vouchers of the configured database from concurrent threads or processes, like "
+            "checkouts do, and reports the throughput, the latency percentiles, busy database errors and vouchers "
+            "redeemed beyond their user limit. The redemptions are committed, so run it against a database filled "
+            "by seed_vouchers. Fails when a voucher was over-redeemed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--processes', action='store_true', help="Run the workers in processes, not threads.")
+        parser.add_argument('--duration', type=float, default=10, help="Seconds to run.")
+        parser.add_argument('--codes', type=int, default=100,
+                            help="Number of active vouchers to redeem, fewer codes mean more contention.")
+        parser.add_argument('--users', type=int, default=1000, help="Number of users redeeming them.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="File for a JSON report.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        targets = list(Voucher.objects.with_status().filter(status=Voucher.ACTIVE).order_by('pk').values_list(
+            'pk', 'code')[:options['codes']])
+        users = list(User.objects.order_by('pk').values_list('pk', flat=True)[:options['users']])
+        if not targets or not users:
+            raise CommandError("There are no active vouchers or no users, fill the database with seed_vouchers.")
+        pks = [pk for pk, code in targets]
+        codes = [code for pk, code in targets]
+        redemptions = VoucherUser.objects.filter(voucher__in=pks, redeemed_at__isnull=False)
+        before = redemptions.count()
+
+        self.stderr.write("Redeeming %d codes for %d users from %d %s for %.0fs..." % (
+            len(codes), len(users), options['workers'], "processes" if options['processes'] else "threads",
+            options['duration']))
+        latencies = []
+        outcomes = Counter(dict.fromkeys(OUTCOMES, 0))
+        errors = Counter()
+        connections.close_all()  # neither forked processes nor threads may share the connection of this one
+        if options['processes']:
+            executor = ProcessPoolExecutor(options['workers'], initializer=init_worker)
+        else:
+            executor = ThreadPoolExecutor(options['workers'])
+        with executor:
+            started = time.time()
+            deadline = started + options['duration']
+            futures = [
+                executor.submit(run_worker, codes, users, deadline, rng.random())
+                for i in range(options['workers'])
+            ]
+            for future in futures:
+                worker_latencies, worker_outcomes, worker_errors = future.result()
+                latencies.extend(worker_latencies)
+                outcomes.update(worker_outcomes)
+                errors.update(worker_errors)
+            seconds = time.time() - started
+
+        vouchers = Voucher.objects.filter(pk__in=pks).annotate(
+            redemptions=count_voucher_users(redeemed_at__isnull=False))
+        over_redeemed = list(vouchers.filter(user_limit__gt=0, redemptions__gt=F('user_limit')).values_list(
+            'code', flat=True))
+        drifted = list(vouchers.exclude(redemptions=F('redeemed_count')).values_list('code', flat=True))
+        latencies.sort()
+        report = {
+            'workers': options['workers'],
+            'processes': options['processes'],
+            'seconds': seconds,
+            'codes': len(codes),
+            'users': len(users),
+            'attempts': len(latencies),
+            'attempts_per_second': len(latencies) / seconds,
+            'redemptions_per_second': outcomes['redeemed'] / seconds,
+            'latency_ms': dict(
+                (name, percentile(latencies, fraction) * 1000 if latencies else None)
+                for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99), ('max', 1))
+            ),
+            'outcomes': outcomes,
+            'errors': errors.most_common(5),
+            # successful redemptions which are not in the database, or redemptions nobody was told about
+            'unaccounted_redemptions': redemptions.count() - before - outcomes['redeemed'],
+            'over_redeemed': over_redeemed,
+            'counter_drift': drifted,
+        }
+        self.write_report(report)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+                f.write("\n")
+        if over_redeemed or drifted or report['unaccounted_redemptions']:
+            raise CommandError("User limits or redemption counters did not hold under load.")
+
+    def write_report(self, report):
+        self.stdout.write("%(attempts)d attempts in %(seconds).1fs: %(attempts_per_second).1f/s, "
+                          "%(redemptions_per_second).1f redemptions/s" % report)
+        if report['attempts']:
+            self.stdout.write("Latency p50 %(p50).2fms, p95 %(p95).2fms, p99 %(p99).2fms, max %(max).2fms" %
+                              report['latency_ms'])
+        self.stdout.write("Outcomes: %s" % ", ".join("%s %d" % (name, report['outcomes'][name]) for name in OUTCOMES))
+        for message, count in report['errors']:
+            self.stdout.write("  %dx %s" % (count, message))
+        self.stdout.write("Over-redeemed vouchers: %d, counter drift: %d, unaccounted redemptions: %d" % (
+            len(report['over_redeemed']), len(report['counter_drift']), report['unaccounted_redemptions']))
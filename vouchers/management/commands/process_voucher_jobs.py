@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from vouchers.models import GenerationJob
+from vouchers.settings import BULK_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = "Generates the vouchers of pending generation jobs, using the database as the queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit when no job is pending.")
+        parser.add_argument('--sleep', type=float, default=5, help="Seconds to wait when no job is pending.")
+        parser.add_argument('--stale-after', type=int, default=600,
+                            help="Seconds without progress after which a running job is taken over.")
+        parser.add_argument('--batch-size', type=int, default=BULK_BATCH_SIZE,
+                            help="Number of vouchers per transaction.")
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            job = GenerationJob.claim(stale_after=options['stale_after'])
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['sleep'])
+                continue
+            self.stdout.write("Running job %d: %s" % (job.pk, job))
+            job.run(batch_size=options['batch_size'])
+            if job.status == GenerationJob.FAILED:
+                self.stderr.write("Job %d failed:\n%s" % (job.pk, job.error))
+            else:
+                self.stdout.write("Job %d generated %d vouchers at %.0f vouchers/s." % (
+                    job.pk, job.generated, job.rate))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from vouchers.cache import invalidate
+from vouchers.models import Voucher
+from vouchers.settings import CACHE_ALIAS
+
+
+class Command(BaseCommand):
+    help = "Recounts the redeemed and bound users of every voucher from its voucher users."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help="Number of voucher ids per transaction.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_pk = Voucher.objects.aggregate(last_pk=Max('pk'))['last_pk'] or 0
+        updated = 0
+        for start in range(0, last_pk + 1, batch_size):
+            updated += Voucher.objects.rebuild_counters(pk__gte=start, pk__lt=start + batch_size)
+            if CACHE_ALIAS is not None:
+                invalidate(*Voucher.objects.filter(
+                    pk__gte=start, pk__lt=start + batch_size).values_list('code', flat=True))
+        self.stdout.write("Recounted %d vouchers." % updated)
@@ -0,0 +1,203 @@
+import random
+import time
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from vouchers.codes import segment, sign
+from vouchers.models import Campaign, Voucher, VoucherUser
+from vouchers.settings import CODE_CHARS, CODE_FILTER, CODE_LENGTH, SEGMENTED_CODES, SIGNED_CODES, VOUCHER_TYPES
+
+VALUES = (5, 10, 20, 25, 50, 100)
+UNLIMITED_REDEMPTIONS = 50  # vouchers without user limit are redeemed this many times the redeemed share on average
+
+
+class Command(BaseCommand):
+    help = ("Fills the database with campaigns, users, vouchers and redemptions for load tests and benchmarks. "
+            "Vouchers and voucher users are inserted with raw executemany statements and consistent counters, and "
+            "the same seed and reference date always produce the same data. Run it again with another seed to add "
+            "more. With a code filter, run build_code_filter afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vouchers', type=int, default=1000000)
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--campaigns', type=int, default=100,
+                            help="Campaign sizes follow Zipf's law, the first campaign is the largest.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--reference', help="Date as 'YYYY-MM-DD' all times are spread around, today by default.")
+        parser.add_argument('--without-campaign', type=float, default=0.2, help="Share of vouchers without campaign.")
+        parser.add_argument('--multi-user', type=float, default=0.1,
+                            help="Share of vouchers for 2 to 20 users.")
+        parser.add_argument('--unlimited', type=float, default=0.02, help="Share of vouchers without user limit.")
+        parser.add_argument('--bound', type=float, default=0.05,
+                            help="Share of single use vouchers bound to a user.")
+        parser.add_argument('--redeemed', type=float, default=0.3,
+                            help="Share of single use vouchers redeemed, multi-user vouchers are partially redeemed "
+                                 "at the same rate on average.")
+        parser.add_argument('--expired', type=float, default=0.1, help="Share of expired vouchers.")
+        parser.add_argument('--never-expiring', type=float, default=0.5, help="Share of vouchers without expiry.")
+        parser.add_argument('--batch-size', type=int, default=20000, help="Number of vouchers per transaction.")
+
+    def handle(self, *args, **options):
+        if options['reference']:
+            try:
+                reference = datetime.strptime(options['reference'], '%Y-%m-%d')
+            except ValueError:
+                raise CommandError("The reference date must be given as YYYY-MM-DD.")
+        else:
+            reference = datetime.combine(timezone.now().date(), datetime.min.time())
+        if settings.USE_TZ:
+            # naive times in the time zone of the connection are passed to the database as they are, which is
+            # much cheaper than converting millions of aware times
+            reference = timezone.make_naive(timezone.make_aware(reference, timezone.utc), connection.timezone)
+        self.reference = reference
+        self.adapt = connection.ops.adapt_datetimefield_value
+        self.options = options
+        self.random = random.Random(options['seed'])
+        if self.seeded():
+            raise CommandError("The database has already been seeded with seed %d." % options['seed'])
+
+        started = time.time()
+        campaigns = self.seed_campaigns(options['campaigns'])
+        self.users = self.seed_users(options['users'])
+        # Zipf weights, so a few campaigns hold most vouchers
+        self.campaign_weights = list(accumulate(1.0 / rank for rank in range(1, len(campaigns) + 1)))
+        self.campaigns = campaigns
+        next_id = (Voucher.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+        seeded = redeemed = 0
+        while seeded < options['vouchers']:
+            count = min(options['batch_size'], options['vouchers'] - seeded)
+            with transaction.atomic():
+                redeemed += self.seed_vouchers(next_id + seeded, count)
+            seeded += count
+            self.stdout.write("Seeded %d vouchers." % seeded)
+        if connection.vendor != 'sqlite':  # ids were given explicitly, the sequence has to catch up
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [Voucher]):
+                    cursor.execute(sql)
+        seconds = time.time() - started
+        self.stdout.write("Done, %d campaigns, %d users, %d vouchers and %d redemptions in %.1fs (%.0f vouchers/s)." % (
+            len(campaigns), len(self.users), seeded, redeemed, seconds, seeded / max(seconds, 1e-9)))
+        if CODE_FILTER:
+            self.stderr.write("The seeded codes are not in the code filter yet, run build_code_filter.")
+
+    def seeded(self):
+        """ Returns whether the seed has been used, by its users, its campaigns or the code of its first voucher. """
+        seed = self.options['seed']
+        return (
+            User.objects.filter(username__startswith="seed%d-" % seed).exists() or
+            Campaign.objects.filter(name__startswith="Seed %d campaign " % seed).exists() or
+            Voucher.objects.filter(code=self.code(random.Random(seed))).exists()
+        )
+
+    def seed_campaigns(self, count):
+        names = ["Seed %d campaign %d" % (self.options['seed'], i) for i in range(count)]
+        Campaign.objects.bulk_create([Campaign(name=name) for name in names])
+        pks = dict(Campaign.objects.filter(name__in=names).values_list('name', 'pk'))
+        return [pks[name] for name in names]
+
+    def seed_users(self, count):
+        prefix = "seed%d-" % self.options['seed']
+        joined = self.adapt(self.reference - timedelta(days=730))
+        fields = ['username', 'password', 'first_name', 'last_name', 'email', 'is_superuser', 'is_staff', 'is_active',
+                  'date_joined']
+        for start in range(0, count, self.options['batch_size']):
+            with transaction.atomic():
+                insert(User, fields, [
+                    ("%s%d" % (prefix, i), "!", "", "", "", False, False, True, joined)  # unusable password
+                    for i in range(start, min(count, start + self.options['batch_size']))
+                ])
+        return list(User.objects.filter(username__startswith=prefix).order_by('pk').values_list('pk', flat=True))
+
+    def seed_vouchers(self, first_id, count):
+        """ Inserts ``count`` vouchers with ids from ``first_id`` and their users, returns the redemptions. """
+        vouchers = []
+        voucher_users = []
+        for pk in range(first_id, first_id + count):
+            row, users = self.voucher(pk)
+            vouchers.append(row)
+            voucher_users.extend(users)
+        insert(Voucher, [
+            'id', 'code', 'value', 'type', 'user_limit', 'created_at', 'valid_until', 'campaign_id',
+            'redeemed_count', 'bound_user_count',
+        ], vouchers)
+        insert(VoucherUser, ['voucher_id', 'user_id', 'redeemed_at'], voucher_users)
+        return sum(row[-2] for row in vouchers)
+
+    def voucher(self, pk):
+        """ Returns the row of a voucher and the rows of its voucher users, with counters matching the users. """
+        rng = self.random
+        options = self.options
+        code = self.code(rng)
+        created_at = self.reference - timedelta(seconds=rng.random() * 730 * 86400)
+        chance = rng.random()
+        if chance < options['expired']:
+            valid_until = created_at + (self.reference - created_at) * rng.random()
+        elif chance < options['expired'] + options['never_expiring']:
+            valid_until = None
+        else:
+            valid_until = self.reference + timedelta(seconds=rng.random() * 365 * 86400)
+        campaign = None
+        if self.campaigns and rng.random() >= options['without_campaign']:
+            campaign = rng.choices(self.campaigns, cum_weights=self.campaign_weights)[0]
+
+        chance = rng.random()
+        if chance < options['unlimited']:
+            user_limit = 0
+            redemptions = int(rng.random() * 2 * options['redeemed'] * UNLIMITED_REDEMPTIONS)
+        elif chance < options['unlimited'] + options['multi_user']:
+            user_limit = rng.randint(2, 20)
+            redemptions = sum(rng.random() < options['redeemed'] for i in range(user_limit))
+        else:
+            user_limit = 1
+            redemptions = int(rng.random() < options['redeemed'])
+        redemptions = min(redemptions, len(self.users) if user_limit != 1 else 1)
+
+        end = min(self.reference, valid_until) if valid_until is not None else self.reference
+        users = []
+        if user_limit == 1 and self.users and rng.random() < options['bound']:
+            redeemed_at = created_at + (end - created_at) * rng.random() if redemptions else None
+            users.append((pk, rng.choice(self.users), redeemed_at))
+        elif user_limit == 1 and redemptions:
+            user = rng.choice(self.users) if self.users else None  # single use vouchers may be redeemed anonymously
+            users.append((pk, user, created_at + (end - created_at) * rng.random()))
+        elif redemptions:
+            for user in rng.sample(self.users, redemptions):
+                users.append((pk, user, created_at + (end - created_at) * rng.random()))
+
+        users = [(voucher, user, self.adapt(redeemed_at)) for voucher, user, redeemed_at in users]
+        redeemed_count = sum(redeemed_at is not None for voucher, user, redeemed_at in users)
+        bound_user_count = sum(user is not None for voucher, user, redeemed_at in users)
+        row = (pk, code, rng.choice(VALUES), rng.choice(VOUCHER_TYPES)[0], user_limit, self.adapt(created_at),
+               self.adapt(valid_until), campaign, redeemed_count, bound_user_count)
+        return row, users
+
+    def code(self, rng):
+        """ Returns the next code of ``rng``, the first voucher draws the first one. """
+        code = "".join(rng.choices(CODE_CHARS, k=CODE_LENGTH))
+        if SEGMENTED_CODES:
+            code = segment(code)
+        if SIGNED_CODES:
+            code = sign(code)
+        return code
+
+
+def insert(model, fields, rows):
+    """ Inserts ``rows`` of values for the ``fields`` of ``model`` with a single executemany statement. """
+    if not rows:
+        return
+    opts = model._meta
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+        connection.ops.quote_name(opts.db_table),
+        ", ".join(connection.ops.quote_name(opts.get_field(name).column) for name in fields),
+        ", ".join(["%s"] * len(fields)),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
@@ -0,0 +1,9 @@
+""" Helpers for commands which run in worker processes. """
+import django
+from django.db import connections
+
+
+def init_worker():
+    django.setup()  # a no-op in forked workers, needed where workers are spawned
+    # forked workers must not reuse the connection of the parent, every worker opens its own
+    connections.close_all()
@@ -0,0 +1,231 @@
+""" Counters and histograms of voucher activity in the Prometheus text format.
+
+Every thread records into a dict of its own without locking, the dicts are added up when the totals are written or
+rendered, and those of finished threads are folded into the totals of the process then. With ``VOUCHERS_METRICS_DIR`` every process writes its totals
+to a file in that directory from a background thread now and then and at exit, and ``render`` adds up the files of
+all processes, e.g. the workers of gunicorn. Clear the directory when the server is restarted, counters of former
+processes are kept until then.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+from .settings import METRICS, METRICS_DIR, METRICS_FLUSH_INTERVAL
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+DEFINITIONS = {
+    'vouchers_redemptions_total': ('counter', "Redeemed vouchers."),
+    'vouchers_validations_total': ('counter', "Validated voucher codes by outcome."),
+    'vouchers_code_collisions_total': ('counter', "Generated codes which were already taken."),
+    'vouchers_operation_seconds': ('histogram', "Latency of voucher operations."),
+}
+
+logger = logging.getLogger('vouchers.metrics')
+
+_local = threading.local()
+_threads = []  # (thread, values) of the threads which recorded something
+_retired = {}  # totals of finished threads
+_process = {'pid': None, 'name': None, 'lock': threading.Lock()}
+
+
+def inc(name, labels=(), amount=1):
+    if not METRICS:
+        return
+    key = (name, labels)
+    values = _values()
+    values[key] = values.get(key, 0) + amount
+
+
+def observe(name, value, labels=()):
+    """ Adds ``value`` to the histogram ``name``, stored as per-bucket counts followed by the sum. """
+    if not METRICS:
+        return
+    key = (name, labels)
+    values = _values()
+    histogram = values.get(key)
+    if histogram is None:
+        histogram = values[key] = [0] * (len(BUCKETS) + 2)
+    histogram[bisect_left(BUCKETS, value)] += 1
+    histogram[-1] += value
+
+
+def timed(operation):
+    """ Decorates a function to observe its latency in ``vouchers_operation_seconds``. """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not METRICS:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe('vouchers_operation_seconds', time.perf_counter() - started, (('operation', operation),))
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    """ Returns the totals of this process. """
+    with _lock():
+        _retire()
+        totals = {}
+        for key, value in _retired.items():
+            _add(totals, key, value)
+        for thread, values in _threads:
+            for key, value in list(values.items()):  # the thread may add a key meanwhile
+                _add(totals, key, value)
+    return totals
+
+
+def collect():
+    """ Returns the totals of all processes sharing ``VOUCHERS_METRICS_DIR``, or of this process without it. """
+    totals = snapshot()
+    if METRICS_DIR is None:
+        return totals
+    own = _file_name()
+    for name in os.listdir(METRICS_DIR):
+        if not name.endswith('.json') or name == own:
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name)) as f:
+                entries = json.load(f)
+        except (IOError, ValueError):  # removed or replaced meanwhile
+            continue
+        for name, labels, value in entries:
+            _add(totals, (name, tuple(tuple(label) for label in labels)), value)
+    return totals
+
+
+def render():
+    lines = []
+    totals = collect()
+    for metric in sorted(DEFINITIONS):
+        kind, help_text = DEFINITIONS[metric]
+        lines.append("# HELP %s %s" % (metric, help_text))
+        lines.append("# TYPE %s %s" % (metric, kind))
+        for (name, labels), value in sorted(totals.items()):
+            if name != metric:
+                continue
+            if kind == 'counter':
+                lines.append("%s%s %s" % (name, _labels(labels), _number(value)))
+                continue
+            count = 0
+            for bound, bucket in zip(BUCKETS + ('+Inf',), value):
+                count += bucket
+                lines.append("%s_bucket%s %d" % (name, _labels(labels + (('le', str(bound)),)), count))
+            lines.append("%s_sum%s %s" % (name, _labels(labels), _number(value[-1])))
+            lines.append("%s_count%s %d" % (name, _labels(labels), count))
+    return "\n".join(lines) + "\n"
+
+
+def flush():
+    """ Writes the totals of this process to its file in ``VOUCHERS_METRICS_DIR``. """
+    if METRICS_DIR is None:
+        return
+    entries = [[name, labels, value] for (name, labels), value in snapshot().items()]
+    path = os.path.join(METRICS_DIR, _file_name())
+    with open(path + '.tmp', 'w') as f:
+        json.dump(entries, f)
+    os.replace(path + '.tmp', path)  # readers never see a partial file
+
+
+def reset():
+    with _lock():
+        _retired.clear()
+        for thread, values in _threads:
+            values.clear()
+
+
+def count_redemptions(sender, vouchers, **kwargs):
+    for voucher in vouchers:
+        inc('vouchers_redemptions_total', (('campaign', str(voucher.campaign_id or "")), ('type', voucher.type)))
+
+
+def _values():
+    """ Returns the dict the current thread records into. """
+    values = getattr(_local, 'values', None)
+    if values is None or _process['pid'] != os.getpid():
+        values = {}
+        with _lock():
+            _retire()
+            _threads.append((threading.current_thread(), values))
+        _local.values = values
+    return values
+
+
+def _retire():
+    """ Folds the values of finished threads into ``_retired``, so the dicts do not pile up with thread churn. """
+    alive = []
+    for thread, values in _threads:
+        if thread.is_alive():
+            alive.append((thread, values))
+            continue
+        for key, value in values.items():
+            _add(_retired, key, value)
+    _threads[:] = alive
+
+
+def _lock():
+    """ Returns the lock guarding the list of threads, starting over in a forked child, which must not report the
+    totals of its parent and may have inherited the lock while another thread of the parent held it.
+    """
+    if _process['pid'] != os.getpid():
+        _process.update(pid=os.getpid(), name=None, lock=threading.Lock())
+        del _threads[:]
+        _retired.clear()
+        if METRICS_DIR is not None:  # threads do not survive a fork, every process starts its own
+            threading.Thread(target=_flush_periodically, name='vouchers-metrics', daemon=True).start()
+    return _process['lock']
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except OSError:  # tried again after the next interval
+            logger.exception("Writing the metrics of this process failed.")
+
+
+def _flush_at_exit():
+    if _process['pid'] == os.getpid():  # only processes which recorded something, not e.g. the gunicorn master
+        flush()
+
+
+def _file_name():
+    if _process['name'] is None:
+        # pids are reused, the random part keeps the file of a former process
+        _process['name'] = '%d-%s.json' % (os.getpid(), os.urandom(4).hex())
+    return _process['name']
+
+
+def _add(totals, key, value):
+    if isinstance(value, list):
+        current = totals.get(key)
+        totals[key] = value[:] if current is None else [a + b for a, b in zip(current, value)]
+    else:
+        totals[key] = totals.get(key, 0) + value
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, _escape(value)) for name, value in labels)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+if METRICS:
+    atexit.register(_flush_at_exit)
@@ -0,0 +1,34 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+def count_voucher_users(apps, schema_editor):
+    Voucher = apps.get_model('vouchers', 'Voucher')
+    VoucherUser = apps.get_model('vouchers', 'VoucherUser')
+    users = VoucherUser.objects.filter(voucher=OuterRef('pk')).order_by().values('voucher')
+    Voucher.objects.update(
+        redeemed_count=Coalesce(Subquery(
+            users.filter(redeemed_at__isnull=False).annotate(count=Count('pk')).values('count')), 0),
+        bound_user_count=Coalesce(Subquery(
+            users.filter(user__isnull=False).annotate(count=Count('pk')).values('count')), 0),
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vouchers', '0002_codesequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voucher',
+            name='bound_user_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Bound user count'),
+        ),
+        migrations.AddField(
+            model_name='voucher',
+            name='redeemed_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Redeemed count'),
+        ),
+        migrations.RunPython(count_voucher_users, migrations.RunPython.noop),
+    ]
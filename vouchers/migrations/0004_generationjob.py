@@ -0,0 +1,41 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vouchers', '0003_voucher_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='pending', max_length=10, verbose_name='Status')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Quantity')),
+                ('type', models.CharField(choices=[('monetary', 'Ringgit Malaysia value discount'), ('percentage', 'Percentage-based discount')], max_length=20, verbose_name='Type')),
+                ('value', models.IntegerField(verbose_name='Value')),
+                ('valid_until', models.DateTimeField(blank=True, null=True, verbose_name='Valid until')),
+                ('prefix', models.CharField(blank=True, max_length=30, verbose_name='Prefix')),
+                ('user_limit', models.PositiveIntegerField(blank=True, null=True, verbose_name='User limit')),
+                ('generated', models.PositiveIntegerField(default=0, verbose_name='Generated')),
+                ('error', models.TextField(blank=True, verbose_name='Error')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Started at')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated at')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finished at')),
+                ('campaign', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='vouchers.Campaign', verbose_name='Campaign')),
+            ],
+            options={
+                'verbose_name_plural': 'Generation jobs',
+                'verbose_name': 'Generation job',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='voucher',
+            name='job',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='vouchers', to='vouchers.GenerationJob', verbose_name='Generation job'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vouchers', '0004_generationjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='voucher',
+            index=models.Index(fields=['valid_until'], name='voucher_valid_until_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voucher',
+            index=models.Index(fields=['campaign', 'created_at'], name='voucher_campaign_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voucheruser',
+            index=models.Index(fields=['voucher', 'redeemed_at'], name='voucheruser_redeemed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voucheruser',
+            index=models.Index(condition=models.Q(redeemed_at__isnull=True), fields=['voucher'], name='voucheruser_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voucheruser',
+            index=models.Index(condition=models.Q(user__isnull=True), fields=['voucher'], name='voucheruser_unbound_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('vouchers', '0005_voucher_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedVoucher',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.IntegerField(db_index=True, verbose_name='Original id')),
+                ('value', models.IntegerField(verbose_name='Value')),
+                ('code', models.CharField(db_index=True, max_length=30, verbose_name='Code')),
+                ('type', models.CharField(choices=[('monetary', 'Ringgit Malaysia value discount'), ('percentage', 'Percentage-based discount')], max_length=20, verbose_name='Type')),
+                ('user_limit', models.PositiveIntegerField(verbose_name='User limit')),
+                ('created_at', models.DateTimeField(verbose_name='Created at')),
+                ('valid_until', models.DateTimeField(blank=True, null=True, verbose_name='Valid until')),
+                ('redeemed_count', models.PositiveIntegerField(verbose_name='Redeemed count')),
+                ('bound_user_count', models.PositiveIntegerField(verbose_name='Bound user count')),
+                ('status', models.CharField(choices=[('active', 'Active'), ('exhausted', 'Exhausted'), ('expired', 'Expired')], max_length=10, verbose_name='Status')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Archived at')),
+                ('campaign', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_vouchers', to='vouchers.Campaign', verbose_name='Campaign')),
+            ],
+            options={
+                'verbose_name_plural': 'Archived vouchers',
+                'verbose_name': 'Archived voucher',
+                'ordering': ['created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedVoucherUser',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('redeemed_at', models.DateTimeField(blank=True, null=True, verbose_name='Redeemed at')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='User')),
+                ('voucher', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='users', to='vouchers.ArchivedVoucher')),
+            ],
+            options={
+                'verbose_name_plural': 'Archived voucher users',
+                'verbose_name': 'Archived voucher user',
+            },
+        ),
+    ]
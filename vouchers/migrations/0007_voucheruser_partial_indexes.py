@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vouchers', '0006_archive'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='voucheruser',
+            name='voucheruser_redeemed_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='voucheruser',
+            name='voucheruser_unbound_idx',
+        ),
+        migrations.AddIndex(
+            model_name='voucheruser',
+            index=models.Index(condition=models.Q(redeemed_at__isnull=False), fields=['voucher', 'redeemed_at'], name='voucheruser_redeemed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='voucheruser',
+            index=models.Index(condition=models.Q(user__isnull=True), fields=['voucher', 'redeemed_at'], name='voucheruser_unbound_idx'),
+        ),
+    ]
@@ -1,64 +1,289 @@
-import random
+import os
+import threading
+import traceback
+from collections import OrderedDict
+from datetime import timedelta
 
 from django.conf import settings
 from django.db import IntegrityError
+from django.db import connection
+from django.db import connections
 from django.db import models
-from django.db.models import CASCADE
-from django.dispatch import Signal
+from django.db import router
+from django.db.utils import load_backend
+from django.db import transaction
+from django.db.models import (
+    CASCADE, SET_NULL, Case, CharField, Count, Exists, F, IntegerField, OuterRef, Q, Subquery, Value, When,
+)
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete
+from django.dispatch import Signal, receiver
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
+from . import metrics
+from .bloom import add_codes, add_codes_on_commit, get_filter
+from .codes import Permutation, code_length, random_strings, segment, sign
+from .profiling import profiled
 from .settings import (
     VOUCHER_TYPES,
-    CODE_LENGTH,
-    CODE_CHARS,
     SEGMENTED_CODES,
-    SEGMENT_LENGTH,
-    SEGMENT_SEPARATOR,
+    BULK_BATCH_SIZE,
+    CODE_STRATEGY,
+    CODE_PERMUTATION_KEY,
+    SEQUENCE_BLOCK_SIZE,
+    SIGNED_CODES,
 )
+from .validation import USED, voucher_error
 
 try:
     user_model = settings.AUTH_USER_MODEL
 except AttributeError:
     from django.contrib.auth.models import User as user_model
+# attempts with new codes after a concurrent writer took one of the generated ones
+CODE_RETRIES = 10
+# attempts of ``redeem_many`` after a concurrent redemption took one of the slots
+REDEEM_RETRIES = 5
+
+# ``redeem_done`` is sent for every redeemed voucher, ``vouchers_redeemed`` once per ``Voucher.redeem`` or
+# ``redeem_many`` with all vouchers it redeemed, for receivers which handle them at once. Both after the commit.
 redeem_done = Signal(providing_args=["voucher"])
+vouchers_redeemed = Signal(providing_args=["vouchers"])
+sequence_permutation = Permutation(CODE_PERMUTATION_KEY)
+
+
+def send_redeemed(vouchers):
+    vouchers_redeemed.send(sender=Voucher, vouchers=vouchers)
+    for voucher in vouchers:
+        redeem_done.send(sender=Voucher, voucher=voucher)
+
+
+def count_voucher_users(**filters):
+    """ Counts the matching users of the outer voucher in a subquery, which only runs for the selected rows. """
+    users = VoucherUser.objects.filter(voucher=OuterRef('pk'), **filters).order_by().values('voucher')
+    return Coalesce(Subquery(users.annotate(count=Count('pk')).values('count'), output_field=IntegerField()), 0)
+
+
+def status_conditions(prefix=""):
+    """ Returns the condition of every voucher status, for vouchers reached through the lookup ``prefix``.
+
+    Expired wins over exhausted, and the conditions only read voucher columns.
+    """
+    expired = Q(**{prefix + 'valid_until__lt': timezone.now()})
+    exhausted = ~expired & Q(**{prefix + 'user_limit__gt': 0, prefix + 'redeemed_count__gte': F(prefix + 'user_limit')})
+    return OrderedDict([
+        (Voucher.EXPIRED, expired),
+        (Voucher.EXHAUSTED, exhausted),
+        (Voucher.ACTIVE, ~expired & ~exhausted),
+    ])
+
+
+def voucher_status():
+    conditions = status_conditions()
+    return Case(
+        When(conditions[Voucher.EXPIRED], then=Value(Voucher.EXPIRED)),
+        When(conditions[Voucher.EXHAUSTED], then=Value(Voucher.EXHAUSTED)),
+        default=Value(Voucher.ACTIVE),
+        output_field=CharField(),
+    )
 
 
 class VoucherManager(models.Manager):
+    @profiled('create_voucher')
     def create_voucher(self, type, value, users=[], valid_until=None, prefix="", campaign=None, user_limit=None):
-        voucher = self.create(
-            value=value,
-            code=Voucher.generate_code(prefix),
-            type=type,
-            valid_until=valid_until,
-            campaign=campaign,
-        )
+        fields = {}
         if user_limit is not None:  # otherwise use default value of model
-            voucher.user_limit = user_limit
-        try:
-            voucher.save()
-        except IntegrityError:
-            # Try again with other code
-            voucher = Voucher.objects.create_voucher(type, value, users, valid_until, prefix, campaign)
+            fields['user_limit'] = user_limit
         if not isinstance(users, list):
             users = [users]
+        users = [user for user in users if user]
+        retries = 0
+        while True:
+            code = Voucher.generate_code(prefix)
+            try:
+                with transaction.atomic():
+                    voucher = self.create(
+                        value=value,
+                        code=code,
+                        type=type,
+                        valid_until=valid_until,
+                        campaign=campaign,
+                        bound_user_count=len(users),
+                        **fields
+                    )
+                break
+            except IntegrityError:
+                # only a taken code is worth another one, any other constraint would fail again
+                if retries >= CODE_RETRIES or not self.filter(code=code).exists():
+                    raise
+                retries += 1
+                metrics.inc('vouchers_code_collisions_total')
         for user in users:
-            if user:
-                VoucherUser(user=user, voucher=voucher).save()
+            VoucherUser(user=user, voucher=voucher).save()
         return voucher
 
-    def create_vouchers(self, quantity, type, value, valid_until=None, prefix="", campaign=None):
+    @profiled('create_vouchers')
+    def create_vouchers(self, quantity, type, value, valid_until=None, prefix="", campaign=None, user_limit=None,
+                        bulk=False, batch_size=BULK_BATCH_SIZE):
+        if not bulk:
+            with transaction.atomic():  # the codes are added to the code filter at once on commit
+                return [
+                    self.create_voucher(type, value, None, valid_until, prefix, campaign, user_limit)
+                    for i in range(quantity)
+                ]
         vouchers = []
-        for i in range(quantity):
-            vouchers.append(self.create_voucher(type, value, None, valid_until, prefix, campaign))
+        with transaction.atomic():
+            for batch in self.create_voucher_batches(
+                    quantity, type, value, valid_until, prefix, campaign, user_limit, batch_size):
+                vouchers.extend(batch)
         return vouchers
 
+    def create_voucher_batches(self, quantity, type, value, valid_until=None, prefix="", campaign=None,
+                               user_limit=None, batch_size=BULK_BATCH_SIZE, job=None):
+        """ Inserts vouchers with ``bulk_create`` and yields each batch as soon as it is written. """
+        fields = {'type': type, 'value': value, 'valid_until': valid_until, 'campaign': campaign, 'job': job}
+        if user_limit is not None:
+            fields['user_limit'] = user_limit
+        created = retries = 0
+        while created < quantity:
+            codes = self._free_codes(min(batch_size, quantity - created), prefix)
+            add_codes(codes)
+            try:
+                with transaction.atomic():
+                    batch = self.bulk_create([Voucher(code=code, **fields) for code in codes])
+                    if batch and batch[0].pk is None:  # the backend does not return ids of bulk inserted rows
+                        batch = list(self.filter(code__in=codes))
+            except IntegrityError:
+                # only a concurrent writer taking one of the free codes is worth a batch with new codes, any other
+                # constraint, e.g. a deleted campaign, would fail again
+                if retries >= CODE_RETRIES or not self.filter(code__in=codes).exists():
+                    raise
+                retries += 1
+                metrics.inc('vouchers_code_collisions_total')
+                continue
+            created += len(batch)
+            retries = 0
+            yield batch
+
+    def _free_codes(self, count, prefix=""):
+        """ Returns ``count`` distinct new codes, regenerating only the ones which are already taken.
+
+        Sequence codes never collide with each other, but still with random or manually entered codes in the table.
+        """
+        bloom = get_filter()
+        codes = set()
+        while len(codes) < count:
+            candidates = set(Voucher.generate_codes(count - len(codes), prefix)) - codes
+            # codes which are not in the filter cannot be taken
+            maybe_taken = candidates if bloom is None else [code for code in candidates if code in bloom]
+            if maybe_taken:
+                taken = set(self.filter(code__in=maybe_taken).values_list('code', flat=True))
+                if taken:
+                    metrics.inc('vouchers_code_collisions_total', amount=len(taken))
+                candidates.difference_update(taken)
+            codes.update(candidates)
+        return codes
+
+    @metrics.timed('redeem_many')
+    @profiled('redeem_many')
+    def redeem_many(self, codes, user=None, types=None):
+        """ Redeems all ``codes`` for ``user`` in one transaction, or none of them.
+
+        Returns a dict mapping every code to ``None`` or the reason why it cannot be redeemed, nothing is redeemed
+        unless all values are ``None``. ``vouchers_redeemed`` is sent once for all vouchers after the commit.
+        """
+        codes = list(OrderedDict.fromkeys(codes))
+        retries = 0
+        while True:
+            try:
+                with transaction.atomic():
+                    # the locks serialise new slots like ``Voucher.redeem``, taken in a fixed order to avoid deadlocks
+                    vouchers = list(self.with_user_state(user).select_for_update().filter(code__in=codes).annotate(
+                        num_users=count_voucher_users()).order_by('pk'))
+                    by_code = dict((voucher.code, voucher) for voucher in vouchers)
+                    results = OrderedDict((code, voucher_error(by_code.get(code), user, types)) for code in codes)
+                    if not any(results.values()):
+                        results.update(self._claim_slots(vouchers, user, timezone.now()))
+                    if any(results.values()):
+                        return results
+                break
+            except IntegrityError:  # a slot was taken concurrently, the state is read again
+                if retries >= REDEEM_RETRIES:
+                    raise
+                retries += 1
+        transaction.on_commit(lambda: send_redeemed(vouchers))
+        return results
+
+    def _claim_slots(self, vouchers, user, now):
+        """ Claims one slot per voucher with set-based statements and returns the codes without a free slot. """
+        slots = {}  # the pending slot bound to the user wins over an unbound one
+        pending = VoucherUser.objects.filter(voucher__in=vouchers, redeemed_at__isnull=True)
+        for pk, voucher_id, user_id in pending.filter(Q(user=user) | Q(user__isnull=True)).values_list(
+                'pk', 'voucher_id', 'user_id').order_by('pk'):
+            if voucher_id not in slots or user_id is not None:
+                slots[voucher_id] = (pk, user is not None and user_id is None)
+        new = [voucher for voucher in vouchers if voucher.pk not in slots]
+        full = [voucher.code for voucher in new if voucher.user_limit != 0 and voucher.num_users >= voucher.user_limit]
+        if full:
+            return dict.fromkeys(full, USED)
+
+        claimed = [pk for pk, bind in slots.values() if not bind]
+        if pending.filter(pk__in=claimed).update(redeemed_at=now) != len(claimed):
+            raise IntegrityError("A pending voucher user was redeemed concurrently.")
+        claimed = [pk for pk, bind in slots.values() if bind]
+        if pending.filter(pk__in=claimed, user__isnull=True).update(user=user, redeemed_at=now) != len(claimed):
+            raise IntegrityError("An unbound voucher user was claimed concurrently.")
+        VoucherUser.objects.bulk_create([VoucherUser(voucher=voucher, user=user, redeemed_at=now) for voucher in new])
+
+        bound = [voucher for voucher in vouchers if slots.get(voucher.pk, (None, user is not None))[1]]
+        self.filter(pk__in=[voucher.pk for voucher in vouchers]).update(redeemed_count=F('redeemed_count') + 1)
+        if bound:
+            self.filter(pk__in=[voucher.pk for voucher in bound]).update(bound_user_count=F('bound_user_count') + 1)
+        for voucher in vouchers:
+            voucher.redeemed_count += 1
+        for voucher in bound:
+            voucher.bound_user_count += 1
+        return {}
+
+    def with_user_state(self, user=None):
+        """ Annotates whether ``user`` is bound to the voucher and whether that binding is redeemed. """
+        bindings = VoucherUser.objects.filter(voucher=OuterRef('pk'), user=user)
+        return self.annotate(
+            user_bound=Exists(bindings),
+            user_redeemed=Exists(bindings.filter(redeemed_at__isnull=False)),
+        )
+
+    def rebuild_counters(self, **filters):
+        """ Recounts ``redeemed_count`` and ``bound_user_count`` of the matching vouchers from ``VoucherUser``. """
+        return self.filter(**filters).update(
+            redeemed_count=count_voucher_users(redeemed_at__isnull=False),
+            bound_user_count=count_voucher_users(user__isnull=False),
+        )
+
     def used(self):
-        return self.exclude(users__redeemed_at__isnull=True)
+        """ Vouchers whose users all redeemed them, without any pending slot. See ``redeemed`` for vouchers redeemed
+        at least once and ``with_status`` for the exhausted ones.
+        """
+        return self._with_slots().filter(has_users=True, has_pending=False)
 
     def unused(self):
-        return self.filter(users__redeemed_at__isnull=True)
+        """ Vouchers without users or with a pending slot, the complement of ``used``. """
+        return self._with_slots().filter(Q(has_users=False) | Q(has_pending=True))
+
+    def redeemed(self):
+        """ Vouchers redeemed at least once. """
+        return self.annotate(has_redemptions=Exists(
+            VoucherUser.objects.filter(voucher=OuterRef('pk'), redeemed_at__isnull=False))).filter(has_redemptions=True)
+
+    def _with_slots(self):
+        # semi-joins which cannot duplicate vouchers, unlike a filter across the reverse relation
+        users = VoucherUser.objects.filter(voucher=OuterRef('pk'))
+        return self.annotate(has_users=Exists(users), has_pending=Exists(users.filter(redeemed_at__isnull=True)))
+
+    def with_status(self):
+        """ Annotates ``status`` as ``Voucher.ACTIVE``, ``EXHAUSTED`` or ``EXPIRED`` from the voucher row alone. """
+        return self.annotate(status=voucher_status())
 
     def expired(self):
         return self.filter(valid_until__lt=timezone.now())
@@ -66,6 +291,15 @@ class VoucherManager(models.Manager):
 
 @python_2_unicode_compatible
 class Voucher(models.Model):
+    ACTIVE = 'active'
+    EXHAUSTED = 'exhausted'
+    EXPIRED = 'expired'
+    STATUSES = (
+        (ACTIVE, _("Active")),
+        (EXHAUSTED, _("Exhausted")),
+        (EXPIRED, _("Expired")),
+    )
+
     value = models.IntegerField(_("Value"), help_text=_("Arbitrary voucher value"))
     code = models.CharField(
         _("Code"), max_length=30, unique=True, blank=True,
@@ -77,6 +311,13 @@ class Voucher(models.Model):
         _("Valid until"), blank=True, null=True,
         help_text=_("Note: Leave empty for vouchers that never expire"))
     campaign = models.ForeignKey('Campaign', verbose_name=_("Campaign"), on_delete=CASCADE, blank=True, null=True, related_name='vouchers')
+    job = models.ForeignKey(
+        'GenerationJob', verbose_name=_("Generation job"), on_delete=SET_NULL, blank=True, null=True,
+        editable=False, related_name='vouchers')
+    # kept up to date by redeem, create_voucher and deletions of voucher users, never by ``save``, see
+    # ``VoucherManager.rebuild_counters``
+    redeemed_count = models.PositiveIntegerField(_("Redeemed count"), default=0, editable=False)
+    bound_user_count = models.PositiveIntegerField(_("Bound user count"), default=0, editable=False)
 
     objects = VoucherManager()
 
@@ -84,14 +325,33 @@ class Voucher(models.Model):
         ordering = ['created_at']
         verbose_name = _("Voucher")
         verbose_name_plural = _("Vouchers")
+        indexes = [
+            models.Index(fields=['valid_until'], name='voucher_valid_until_idx'),
+            models.Index(fields=['campaign', 'created_at'], name='voucher_campaign_created_idx'),
+        ]
 
     def __str__(self):
         return self.code
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Voucher, cls).from_db(db, field_names, values)
+        # remembered to invalidate the cache entry of the former code when the code is changed
+        instance._loaded_code = dict(zip(field_names, values)).get('code')
+        return instance
+
     def save(self, *args, **kwargs):
         if not self.code:
             self.code = Voucher.generate_code()
+        if not self._state.adding and not args and not kwargs.get('force_insert') and 'update_fields' not in kwargs:
+            # the counters are only changed by guarded updates, an instance loaded before a redemption is stale
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in ('redeemed_count', 'bound_user_count')]
         super(Voucher, self).save(*args, **kwargs)
+        if self.code != getattr(self, '_loaded_code', None):  # new or renamed
+            add_codes_on_commit([self.code], kwargs.get('using') or self._state.db)
+        self._loaded_code = self.code
 
     def expired(self):
         return self.valid_until is not None and self.valid_until < timezone.now()
@@ -99,38 +359,90 @@ class Voucher(models.Model):
     @property
     def is_redeemed(self):
         """ Returns true is a voucher is redeemed (completely for all users) otherwise returns false. """
-        return self.users.filter(
-            redeemed_at__isnull=False
-        ).count() >= self.user_limit and self.user_limit is not 0
+        return self.user_limit != 0 and self.redeemed_count >= self.user_limit
+
+    def update_counters(self):
+        """ Recounts the counters in one ``UPDATE``, so a concurrent redemption cannot be lost, and reloads them. """
+        from .cache import invalidate  # the cache module reads the models
+
+        Voucher.objects.rebuild_counters(pk=self.pk)
+        self.refresh_from_db(fields=['redeemed_count', 'bound_user_count'])
+        invalidate(self.code)  # a queryset update sends no post_save
 
     @property
     def redeemed_at(self):
-        try:
-            return self.users.filter(redeemed_at__isnull=False).order_by('redeemed_at').last().redeemed_at
-        except self.users.through.DoesNotExist:
-            return None
+        """ Returns the latest redemption time, read from the ``(voucher, redeemed_at)`` index, or ``None``. """
+        return self.users.filter(redeemed_at__isnull=False).order_by('-redeemed_at').values_list(
+            'redeemed_at', flat=True).first()
 
     @classmethod
     def generate_code(cls, prefix="", segmented=SEGMENTED_CODES):
-        code = "".join(random.choice(CODE_CHARS) for i in range(CODE_LENGTH))
-        if segmented:
-            code = SEGMENT_SEPARATOR.join([code[i:i + SEGMENT_LENGTH] for i in range(0, len(code), SEGMENT_LENGTH)])
-            return prefix + code
+        return cls.generate_codes(1, prefix, segmented)[0]
+
+    @classmethod
+    def generate_codes(cls, n, prefix="", segmented=SEGMENTED_CODES):
+        """ Returns ``n`` distinct random codes built from one bulk read of the system's CSPRNG. """
+        max_length = cls._meta.get_field('code').max_length
+        if code_length(prefix, segmented) > max_length:
+            raise ValueError("Codes with the prefix %r would be longer than %d characters." % (prefix, max_length))
+        if CODE_STRATEGY == 'sequence':
+            codes = [sequence_permutation.code(number) for number in CodeSequence.take(n)]
         else:
-            return prefix + code
+            codes = random_strings(n)
+        if segmented:
+            codes = [segment(code) for code in codes]
+        if SIGNED_CODES:
+            return [sign(prefix + code) for code in codes]
+        return [prefix + code for code in codes]
 
+    @metrics.timed('redeem')
+    @profiled('redeem')
     def redeem(self, user=None):
+        """ Redeems the voucher for ``user`` and returns whether a free slot could be claimed.
+
+        ``redeem_done`` and ``vouchers_redeemed`` are sent once the surrounding transaction is committed.
+        """
+        with transaction.atomic():
+            redeemed = self._claim_slot(user, timezone.now())
+        if redeemed:
+            transaction.on_commit(lambda: send_redeemed([self]))
+        return redeemed
+
+    def _claim_slot(self, user, now):
+        """ Claims a slot with guarded statements, so concurrent redemptions cannot exceed ``user_limit``. """
+        users = VoucherUser.objects.filter(voucher=self)
+        # the pending slot bound to the user, or without user the unbound one
+        if users.filter(user=user, redeemed_at__isnull=True).update(redeemed_at=now):
+            return self._count_redemption(bound=False)
+        if user is not None:
+            if users.filter(user=user).exists():  # already redeemed by the user
+                return False
+            # silently fix unbouned or nulled voucher users
+            slots = users.filter(user__isnull=True, redeemed_at__isnull=True)
+            if connection.features.has_select_for_update_skip_locked:
+                slots = slots.select_for_update(skip_locked=True)
+            for pk in slots.values_list('pk', flat=True)[:1]:
+                if users.filter(pk=pk, user__isnull=True, redeemed_at__isnull=True).update(user=user, redeemed_at=now):
+                    return self._count_redemption(bound=True)
+        # new slots are serialised by the lock on the voucher, SQLite already holds a database lock since the update
+        user_limit = Voucher.objects.select_for_update().values_list('user_limit', flat=True).get(pk=self.pk)
+        if user_limit != 0 and users.count() >= user_limit:
+            return False
         try:
-            voucher_user = self.users.get(user=user)
-        except VoucherUser.DoesNotExist:
-            try:  # silently fix unbouned or nulled voucher users
-                voucher_user = self.users.get(user__isnull=True)
-                voucher_user.user = user
-            except VoucherUser.DoesNotExist:
-                voucher_user = VoucherUser(voucher=self, user=user)
-        voucher_user.redeemed_at = timezone.now()
-        voucher_user.save()
-        redeem_done.send(sender=self.__class__, voucher=self)
+            with transaction.atomic():
+                VoucherUser.objects.create(voucher=self, user=user, redeemed_at=now)
+        except IntegrityError:  # redeemed concurrently by the same user
+            return False
+        return self._count_redemption(bound=user is not None)
+
+    def _count_redemption(self, bound):
+        counters = {'redeemed_count': F('redeemed_count') + 1}
+        if bound:
+            counters['bound_user_count'] = F('bound_user_count') + 1
+        Voucher.objects.filter(pk=self.pk).update(**counters)
+        self.redeemed_count += 1
+        self.bound_user_count += bound
+        return True
 
 
 @python_2_unicode_compatible
@@ -147,6 +459,186 @@ class Campaign(models.Model):
         return self.name
 
 
+@python_2_unicode_compatible
+class GenerationJob(models.Model):
+    """ A request to generate vouchers in the background, queued in the database for ``process_voucher_jobs``. """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, _("Pending")),
+        (RUNNING, _("Running")),
+        (DONE, _("Done")),
+        (FAILED, _("Failed")),
+    )
+
+    status = models.CharField(_("Status"), max_length=10, choices=STATUSES, default=PENDING, db_index=True)
+    quantity = models.PositiveIntegerField(_("Quantity"))
+    type = models.CharField(_("Type"), max_length=20, choices=VOUCHER_TYPES)
+    value = models.IntegerField(_("Value"))
+    valid_until = models.DateTimeField(_("Valid until"), blank=True, null=True)
+    prefix = models.CharField(_("Prefix"), max_length=30, blank=True)
+    campaign = models.ForeignKey(Campaign, verbose_name=_("Campaign"), on_delete=SET_NULL, blank=True, null=True)
+    user_limit = models.PositiveIntegerField(_("User limit"), blank=True, null=True)
+    generated = models.PositiveIntegerField(_("Generated"), default=0)
+    error = models.TextField(_("Error"), blank=True)
+    created_at = models.DateTimeField(_("Created at"), auto_now_add=True)
+    started_at = models.DateTimeField(_("Started at"), blank=True, null=True)
+    updated_at = models.DateTimeField(_("Updated at"), auto_now=True)
+    finished_at = models.DateTimeField(_("Finished at"), blank=True, null=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = _("Generation job")
+        verbose_name_plural = _("Generation jobs")
+
+    def __str__(self):
+        return "%s %s x %s" % (self.quantity, self.type, self.value)
+
+    @property
+    def finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    @property
+    def rate(self):
+        """ Vouchers generated per second. """
+        if self.started_at is None:
+            return 0
+        seconds = ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+        return self.generated / seconds if seconds > 0 else 0
+
+    @classmethod
+    def claim(cls, stale_after=None):
+        """ Marks the oldest pending job as running and returns it, or ``None`` if there is nothing to do.
+
+        Running jobs without progress for ``stale_after`` seconds are taken over, since their worker died.
+        """
+        jobs = Q(status=cls.PENDING)
+        if stale_after is not None:
+            jobs |= Q(status=cls.RUNNING, updated_at__lt=timezone.now() - timedelta(seconds=stale_after))
+        for pk in cls.objects.filter(jobs).order_by('created_at').values_list('pk', flat=True)[:10]:
+            # the guarded update lets only one worker win the job
+            if cls.objects.filter(jobs, pk=pk).update(status=cls.RUNNING, updated_at=timezone.now(),
+                                                      started_at=Coalesce('started_at', timezone.now())):
+                return cls.objects.get(pk=pk)
+        return None
+
+    def run(self, batch_size=BULK_BATCH_SIZE):
+        """ Generates the missing vouchers in committed batches and records the progress after each one. """
+        self.generated = self.vouchers.count()  # a resumed job keeps what was committed before
+        try:
+            batches = Voucher.objects.create_voucher_batches(
+                self.quantity - self.generated, self.type, self.value, self.valid_until, self.prefix, self.campaign,
+                self.user_limit, batch_size, job=self)
+            for batch in batches:
+                self.generated += len(batch)
+                self.save(update_fields=['generated', 'updated_at'])
+        except Exception:
+            self.status = self.FAILED
+            self.error = traceback.format_exc()
+        else:
+            self.status = self.DONE
+        self.finished_at = timezone.now()
+        self.save(update_fields=['status', 'error', 'finished_at', 'updated_at'])
+
+
+class CodeSequence(models.Model):
+    """ Hands out blocks of sequence numbers for the ``sequence`` code strategy. """
+    name = models.CharField(_("Name"), max_length=50, unique=True)
+    value = models.BigIntegerField(_("Value"), default=0)
+
+    _blocks = {}
+    _lock = threading.Lock()
+
+    class Meta:
+        verbose_name = _("Code sequence")
+        verbose_name_plural = _("Code sequences")
+
+    @classmethod
+    def reserve(cls, count, name='codes'):
+        """ Reserves ``count`` consecutive numbers. The update comes first to lock the row before it is read.
+
+        Inside a transaction the numbers are reserved on a second connection, like a database sequence, so the row
+        is not locked until the caller commits. SQLite serialises all writers anyway, a second connection would only
+        wait for the first one.
+        """
+        alias = router.db_for_write(cls)
+        if transaction.get_connection(alias).in_atomic_block and connections[alias].vendor != 'sqlite':
+            return cls._reserve_separately(alias, count, name)
+        with transaction.atomic(using=alias):
+            if not cls.objects.filter(name=name).update(value=F('value') + count):
+                try:
+                    with transaction.atomic(using=alias):
+                        cls.objects.create(name=name, value=count)
+                    return range(0, count)
+                except IntegrityError:  # created concurrently
+                    cls.objects.filter(name=name).update(value=F('value') + count)
+            end = cls.objects.filter(name=name).values_list('value', flat=True).get()
+        return range(end - count, end)
+
+    @classmethod
+    def _reserve_separately(cls, alias, count, name):
+        """ Reserves the numbers on a connection of their own, committed whatever the caller does afterwards. """
+        other = load_backend(connections[alias].settings_dict['ENGINE']).DatabaseWrapper(
+            connections[alias].settings_dict, alias)
+        quote = other.ops.quote_name
+        table = quote(cls._meta.db_table)
+        name_column = quote(cls._meta.get_field('name').column)
+        value_column = quote(cls._meta.get_field('value').column)
+        try:
+            for attempt in range(2):
+                other.set_autocommit(False)
+                try:
+                    with other.cursor() as cursor:
+                        cursor.execute("UPDATE %s SET %s = %s + %%s WHERE %s = %%s" % (
+                            table, value_column, value_column, name_column), [count, name])
+                        if not cursor.rowcount:
+                            cursor.execute("INSERT INTO %s (%s, %s) VALUES (%%s, %%s)" % (
+                                table, name_column, value_column), [name, count])
+                        cursor.execute("SELECT %s FROM %s WHERE %s = %%s" % (value_column, table, name_column), [name])
+                        end = cursor.fetchone()[0]
+                    other.commit()
+                    return range(end - count, end)
+                except IntegrityError:  # created concurrently, updated by the second attempt
+                    other.rollback()
+                    if attempt:
+                        raise
+                except Exception:
+                    other.rollback()
+                    raise
+                finally:
+                    other.set_autocommit(True)
+        finally:
+            other.close()
+
+    @classmethod
+    def keeps_blocks(cls):
+        """ Returns whether reserved numbers stay reserved when the caller rolls back, so blocks can be kept. """
+        alias = router.db_for_write(cls)
+        return not transaction.get_connection(alias).in_atomic_block or connections[alias].vendor != 'sqlite'
+
+    @classmethod
+    def take(cls, count, name='codes'):
+        """ Returns ``count`` unused numbers and keeps the rest of a reserved block for the next calls.
+
+        Blocks are only kept when they cannot be rolled back, which would hand them out again.
+        """
+        key = (os.getpid(), name)  # forked processes must not share a block
+        with cls._lock:
+            block = cls._blocks.pop(key, range(0))
+            numbers = list(block[:count])
+            block = block[count:]
+            if len(numbers) < count:
+                missing = count - len(numbers)
+                block = cls.reserve(max(missing, SEQUENCE_BLOCK_SIZE) if cls.keeps_blocks() else missing, name)
+                numbers.extend(block[:missing])
+                block = block[missing:]
+            if block:
+                cls._blocks[key] = block
+        return numbers
+
+
 @python_2_unicode_compatible
 class VoucherUser(models.Model):
     voucher = models.ForeignKey(Voucher, on_delete=CASCADE, related_name='users')
@@ -155,6 +647,98 @@ class VoucherUser(models.Model):
 
     class Meta:
         unique_together = (('voucher', 'user'),)
+        indexes = [
+            # partial where the backend supports it, plain indexes otherwise. The redeemed and pending rows are
+            # indexed apart, so the slot lookups of redemptions do not compete with the redeemed rows for an index
+            models.Index(fields=['voucher', 'redeemed_at'], name='voucheruser_redeemed_idx',
+                         condition=Q(redeemed_at__isnull=False)),
+            models.Index(fields=['voucher'], name='voucheruser_pending_idx', condition=Q(redeemed_at__isnull=True)),
+            models.Index(fields=['voucher', 'redeemed_at'], name='voucheruser_unbound_idx',
+                         condition=Q(user__isnull=True)),
+        ]
+
+    def __str__(self):
+        return str(self.user)
+
+
+@receiver(post_delete, sender=VoucherUser)
+def discount_voucher_user(sender, instance, **kwargs):
+    """ Takes a deleted voucher user, e.g. one of a deleted user, off the counters of its voucher. """
+    counters = {}
+    if instance.redeemed_at is not None:
+        counters['redeemed_count'] = Greatest(F('redeemed_count') - 1, 0)
+    if instance.user_id is not None:
+        counters['bound_user_count'] = Greatest(F('bound_user_count') - 1, 0)
+    if counters:
+        Voucher.objects.filter(pk=instance.voucher_id).update(**counters)
+
+
+@python_2_unicode_compatible
+class ArchivedVoucher(models.Model):
+    """ A voucher moved out of the live table by ``archive_vouchers``. """
+    original_id = models.IntegerField(_("Original id"), db_index=True)
+    value = models.IntegerField(_("Value"))
+    code = models.CharField(_("Code"), max_length=30, db_index=True)
+    type = models.CharField(_("Type"), max_length=20, choices=VOUCHER_TYPES)
+    user_limit = models.PositiveIntegerField(_("User limit"))
+    created_at = models.DateTimeField(_("Created at"))
+    valid_until = models.DateTimeField(_("Valid until"), blank=True, null=True)
+    campaign = models.ForeignKey(Campaign, verbose_name=_("Campaign"), on_delete=CASCADE, blank=True, null=True,
+                                 related_name='archived_vouchers')
+    redeemed_count = models.PositiveIntegerField(_("Redeemed count"))
+    bound_user_count = models.PositiveIntegerField(_("Bound user count"))
+    status = models.CharField(_("Status"), max_length=10, choices=Voucher.STATUSES)
+    archived_at = models.DateTimeField(_("Archived at"), auto_now_add=True)
+
+    class Meta:
+        ordering = ['created_at']
+        verbose_name = _("Archived voucher")
+        verbose_name_plural = _("Archived vouchers")
+
+    def __str__(self):
+        return self.code
+
+    @classmethod
+    def archive(cls, vouchers):
+        """ Moves ``vouchers`` annotated by ``with_status`` and their users to the archive in one transaction.
+
+        Returns the number of archived vouchers.
+        """
+        pks = [voucher.pk for voucher in vouchers]
+        with transaction.atomic():
+            cls.objects.bulk_create([cls(
+                original_id=voucher.pk,
+                value=voucher.value,
+                code=voucher.code,
+                type=voucher.type,
+                user_limit=voucher.user_limit,
+                created_at=voucher.created_at,
+                valid_until=voucher.valid_until,
+                campaign_id=voucher.campaign_id,
+                redeemed_count=voucher.redeemed_count,
+                bound_user_count=voucher.bound_user_count,
+                status=voucher.status,
+            ) for voucher in vouchers])
+            # ids of deleted vouchers may be reused, the latest archived row is the one just inserted
+            archived = dict(cls.objects.filter(original_id__in=pks).order_by('pk').values_list('original_id', 'pk'))
+            users = VoucherUser.objects.filter(voucher__in=pks)
+            ArchivedVoucherUser.objects.bulk_create([
+                ArchivedVoucherUser(voucher_id=archived[voucher_id], user_id=user_id, redeemed_at=redeemed_at)
+                for voucher_id, user_id, redeemed_at in users.values_list('voucher_id', 'user_id', 'redeemed_at')
+            ])
+            users.delete()
+            return Voucher.objects.filter(pk__in=pks).delete()[1].get(Voucher._meta.label, 0)
+
+
+@python_2_unicode_compatible
+class ArchivedVoucherUser(models.Model):
+    voucher = models.ForeignKey(ArchivedVoucher, on_delete=CASCADE, related_name='users')
+    user = models.ForeignKey(user_model, verbose_name=_("User"), on_delete=CASCADE, null=True, blank=True)
+    redeemed_at = models.DateTimeField(_("Redeemed at"), blank=True, null=True)
+
+    class Meta:
+        verbose_name = _("Archived voucher user")
+        verbose_name_plural = _("Archived voucher users")
 
     def __str__(self):
         return str(self.user)
@@ -0,0 +1,149 @@
+""" Wall time, query count and SQL time of voucher operations, reported to pluggable sinks.
+
+A sink is any callable taking a ``Sample``. Without sinks nothing is measured, and a profiled function costs one
+extra call and a list check.
+"""
+import logging
+import socket
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import ExitStack
+from functools import wraps
+
+from django.db import connections
+from django.utils.module_loading import import_string
+
+from .settings import PROFILING_SINKS, PROFILING_BUFFER_SIZE, STATSD_ADDRESS, STATSD_PREFIX
+
+Sample = namedtuple('Sample', ['name', 'seconds', 'queries', 'sql_seconds'])
+
+sinks = []
+
+
+def add_sink(sink):
+    sinks.append(sink)
+
+
+def remove_sink(sink):
+    sinks.remove(sink)
+
+
+class profile(object):
+    """ Measures the enclosed block as ``name`` and hands the sample to every sink.
+
+    Queries are counted with an execute wrapper on every database connection of the current thread.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.stack = None
+        if sinks:
+            self.stack = ExitStack()
+            for connection in connections.all():
+                self.stack.enter_context(connection.execute_wrapper(self.execute))
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.stack is None:
+            return
+        seconds = time.perf_counter() - self.started
+        self.stack.close()
+        sample = Sample(self.name, seconds, self.queries, self.sql_seconds)
+        for sink in list(sinks):
+            sink(sample)
+
+    def execute(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.sql_seconds += time.perf_counter() - started
+
+
+def profiled(name):
+    """ Decorates a function to be measured as ``name``. """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not sinks:
+                return func(*args, **kwargs)
+            with profile(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class LogSink(object):
+    def __init__(self, logger='vouchers.profiling', level=logging.INFO):
+        self.logger = logging.getLogger(logger)
+        self.level = level
+
+    def __call__(self, sample):
+        self.logger.log(
+            self.level, "%s took %.2fms with %d queries in %.2fms", sample.name, sample.seconds * 1000,
+            sample.queries, sample.sql_seconds * 1000, extra={'sample': sample})
+
+
+class RingBufferSink(object):
+    """ Keeps the latest ``size`` samples of the process in memory. """
+
+    def __init__(self, size=PROFILING_BUFFER_SIZE):
+        self.buffer = deque(maxlen=size)
+
+    def __call__(self, sample):
+        self.buffer.append(sample)  # appending to a deque is thread-safe
+
+    def samples(self, name=None):
+        return [sample for sample in list(self.buffer) if name is None or sample.name == name]
+
+    def clear(self):
+        self.buffer.clear()
+
+
+class StatsdSink(object):
+    """ Sends every sample as statsd timers and counters over UDP, dropping it if nobody listens. """
+
+    def __init__(self, address=STATSD_ADDRESS, prefix=STATSD_PREFIX):
+        self.address = tuple(address)
+        self.prefix = prefix
+        self.local = threading.local()
+
+    def __call__(self, sample):
+        name = "%s.%s" % (self.prefix, sample.name)
+        payload = "\n".join([
+            "%s.calls:1|c" % name,
+            "%s.time:%.3f|ms" % (name, sample.seconds * 1000),
+            "%s.queries:%d|c" % (name, sample.queries),
+            "%s.sql_time:%.3f|ms" % (name, sample.sql_seconds * 1000),
+        ])
+        try:
+            self.socket().sendto(payload.encode('ascii'), self.address)
+        except (OSError, UnicodeEncodeError):
+            pass
+
+    def socket(self):
+        if not hasattr(self.local, 'socket'):
+            self.local.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        return self.local.socket
+
+
+SINKS = {
+    'log': LogSink,
+    'buffer': RingBufferSink,
+    'statsd': StatsdSink,
+}
+
+
+def configure(names=PROFILING_SINKS):
+    """ Replaces the sinks by the ones named in ``VOUCHERS_PROFILING_SINKS`` or given by dotted path. """
+    sinks[:] = [SINKS[name]() if name in SINKS else import_string(name)() for name in names]
+
+
+configure()
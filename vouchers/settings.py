@@ -14,3 +14,57 @@ CODE_CHARS = getattr(settings, 'VOUCHERS_CODE_CHARS', string.ascii_letters+strin
 SEGMENTED_CODES = getattr(settings, 'VOUCHERS_SEGMENTED_CODES', False)
 SEGMENT_LENGTH = getattr(settings, 'VOUCHERS_SEGMENT_LENGTH', 4)
 SEGMENT_SEPARATOR = getattr(settings, 'VOUCHERS_SEGMENT_SEPARATOR', "-")
+
+BULK_BATCH_SIZE = getattr(settings, 'VOUCHERS_BULK_BATCH_SIZE', 500)
+
+# ``random`` draws every code from the CSPRNG, ``sequence`` maps reserved sequence numbers through a keyed
+# permutation so that generated codes never collide with each other. Both are checked against the existing codes.
+CODE_STRATEGY = getattr(settings, 'VOUCHERS_CODE_STRATEGY', 'random')
+CODE_PERMUTATION_KEY = getattr(settings, 'VOUCHERS_CODE_PERMUTATION_KEY', settings.SECRET_KEY)
+SEQUENCE_BLOCK_SIZE = getattr(settings, 'VOUCHERS_SEQUENCE_BLOCK_SIZE', 1000)
+
+# Signed codes end with a truncated HMAC of the rest of the code, which lets forged codes be rejected without a
+# database lookup. Unsigned codes keep working until ``VOUCHERS_ACCEPT_UNSIGNED_CODES`` is turned off.
+SIGNED_CODES = getattr(settings, 'VOUCHERS_SIGNED_CODES', False)
+SIGNING_KEY = getattr(settings, 'VOUCHERS_SIGNING_KEY', settings.SECRET_KEY)
+SIGNATURE_LENGTH = getattr(settings, 'VOUCHERS_SIGNATURE_LENGTH', 6)
+SIGNATURE_SEPARATOR = getattr(settings, 'VOUCHERS_SIGNATURE_SEPARATOR', ".")
+ACCEPT_UNSIGNED_CODES = getattr(settings, 'VOUCHERS_ACCEPT_UNSIGNED_CODES', True)
+
+# Alias of the Django cache that holds voucher snapshots by code, ``None`` turns the cache off. The optional
+# per-process LRU in front of it is not invalidated across processes, so keep its timeout short.
+CACHE_ALIAS = getattr(settings, 'VOUCHERS_CACHE', None)
+CACHE_TIMEOUT = getattr(settings, 'VOUCHERS_CACHE_TIMEOUT', 300)
+LOCAL_CACHE_SIZE = getattr(settings, 'VOUCHERS_LOCAL_CACHE_SIZE', 0)
+LOCAL_CACHE_TIMEOUT = getattr(settings, 'VOUCHERS_LOCAL_CACHE_TIMEOUT', 5)
+
+# A Bloom filter of all codes rejects unknown codes without a database lookup. It is stored in the file at
+# ``VOUCHERS_CODE_FILTER_PATH`` or, without a path, in the voucher cache (or the default cache), and has to be built
+# once with the ``build_code_filter`` command.
+CODE_FILTER = getattr(settings, 'VOUCHERS_CODE_FILTER', False)
+CODE_FILTER_PATH = getattr(settings, 'VOUCHERS_CODE_FILTER_PATH', None)
+CODE_FILTER_CAPACITY = getattr(settings, 'VOUCHERS_CODE_FILTER_CAPACITY', 1000000)
+CODE_FILTER_ERROR_RATE = getattr(settings, 'VOUCHERS_CODE_FILTER_ERROR_RATE', 0.001)
+
+# Generation requests of at least this many vouchers are run by the ``process_voucher_jobs`` worker.
+BACKGROUND_THRESHOLD = getattr(settings, 'VOUCHERS_BACKGROUND_THRESHOLD', 10000)
+
+# Exhausted vouchers and vouchers expired for this many days are moved to the archive tables by ``archive_vouchers``.
+# With ``VOUCHERS_ARCHIVE_LOOKUP`` the voucher form looks unknown codes up in the archive, to tell used and expired
+# codes apart from invalid ones. The code filter includes the archived codes then, rebuild it when turning it on.
+ARCHIVE_AFTER_DAYS = getattr(settings, 'VOUCHERS_ARCHIVE_AFTER_DAYS', 90)
+ARCHIVE_LOOKUP = getattr(settings, 'VOUCHERS_ARCHIVE_LOOKUP', False)
+
+# Sinks receiving the wall time, query count and SQL time of voucher operations: ``"log"``, ``"buffer"``,
+# ``"statsd"`` or dotted paths to sink classes. Nothing is measured without sinks.
+PROFILING_SINKS = getattr(settings, 'VOUCHERS_PROFILING_SINKS', [])
+PROFILING_BUFFER_SIZE = getattr(settings, 'VOUCHERS_PROFILING_BUFFER_SIZE', 1000)
+STATSD_ADDRESS = getattr(settings, 'VOUCHERS_STATSD_ADDRESS', ('127.0.0.1', 8125))
+STATSD_PREFIX = getattr(settings, 'VOUCHERS_STATSD_PREFIX', 'vouchers')
+
+# Counters and latency histograms served in the Prometheus text format by the ``metrics`` view. Every process
+# writes its totals to ``VOUCHERS_METRICS_DIR`` every ``VOUCHERS_METRICS_FLUSH_INTERVAL`` seconds and at exit, so
+# that any worker can report the sum of all workers sharing the directory.
+METRICS = getattr(settings, 'VOUCHERS_METRICS', False)
+METRICS_DIR = getattr(settings, 'VOUCHERS_METRICS_DIR', None)
+METRICS_FLUSH_INTERVAL = getattr(settings, 'VOUCHERS_METRICS_FLUSH_INTERVAL', 5)
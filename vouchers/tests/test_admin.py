@@ -1,11 +1,18 @@
+import csv
 import django
+import json
 
 from distutils.version import StrictVersion
 from unittest import skipIf
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.admin.sites import AdminSite
-from vouchers.admin import VoucherAdmin
-from vouchers.models import Voucher
+from django.contrib.auth.models import User
+from django.db import connection
+from django.urls import reverse
+from django.utils import timezone
+from vouchers.admin import CampaignAdmin, VoucherAdmin
+from vouchers.models import Campaign, Voucher
 
 class MockRequest(object):
     pass
@@ -24,3 +31,81 @@ class VoucherAdminTestCase(TestCase):
             list(admin.get_fields(request)),
             ['value', 'code', 'type', 'user_limit', 'valid_until', 'campaign']
         )
+
+class ChangelistTestCase(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "admin"))
+        self.campaign = Campaign.objects.create(name="campaign")
+        self.user = User.objects.create(username="user1")
+
+    def create_vouchers(self, quantity):
+        for i in range(quantity):
+            voucher = Voucher.objects.create_voucher('monetary', 100, self.user, campaign=self.campaign)
+            if i % 2:
+                voucher.redeem(self.user)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_constant_queries(self):
+        for name in ('admin:vouchers_voucher_changelist', 'admin:vouchers_campaign_changelist'):
+            self.create_vouchers(2)
+            queries = self.count_queries(reverse(name))
+            self.create_vouchers(20)
+            Campaign.objects.create(name="other %s" % name)
+            self.assertEqual(self.count_queries(reverse(name)), queries)
+
+    def test_sorting(self):
+        self.create_vouchers(3)
+        for name in ('admin:vouchers_voucher_changelist', 'admin:vouchers_campaign_changelist'):
+            for column in range(1, 6):
+                self.assertEqual(self.client.get(reverse(name), {'o': column}).status_code, 200)
+
+    def test_campaign_counts(self):
+        self.create_vouchers(3)
+        Voucher.objects.create_voucher('monetary', 100, campaign=self.campaign, valid_until=timezone.now())
+        campaign = CampaignAdmin(Campaign, AdminSite()).get_queryset(request).get()
+        self.assertEqual(
+            (campaign.vouchers_count, campaign.used_count, campaign.unused_count, campaign.expired_count),
+            (4, 1, 3, 1)
+        )
+        self.assertEqual(campaign.exhausted_count, 1)
+
+    def test_status_filter(self):
+        self.create_vouchers(4)
+        url = reverse('admin:vouchers_voucher_changelist')
+        for status, count in (('active', 2), ('exhausted', 2), ('expired', 0)):
+            response = self.client.get(url, {'status': status})
+            self.assertEqual(response.context['cl'].result_count, count)
+
+class GenerateVouchersTestCase(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "admin"))
+        self.campaign = Campaign.objects.create(name="campaign")
+        self.data = {'quantity': 5, 'value': 42, 'type': 'monetary', 'campaign': self.campaign.pk}
+
+    def test_table(self):
+        response = self.client.post(reverse('admin:generate_vouchers'), self.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['vouchers']), 5)
+        self.assertEqual(Voucher.objects.filter(campaign=self.campaign).count(), 5)
+
+    def test_csv(self):
+        response = self.client.post(reverse('admin:generate_vouchers'), dict(self.data, output='csv'))
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(b"".join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], ['id', 'code', 'campaign', 'valid_until'])
+        self.assertEqual(
+            sorted(row[1] for row in rows[1:]),
+            sorted(Voucher.objects.values_list('code', flat=True))
+        )
+        self.assertEqual(set(row[2] for row in rows[1:]), {"campaign"})
+
+    def test_ndjson(self):
+        response = self.client.post(reverse('admin:generate_vouchers'), dict(self.data, output='ndjson'))
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(Voucher.objects.get(code=rows[0]['code']).pk, rows[0]['id'])
@@ -0,0 +1,98 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from vouchers.forms import VoucherForm
+from vouchers.models import ArchivedVoucher, ArchivedVoucherUser, Campaign, Voucher, VoucherUser
+from vouchers.validation import validate_codes
+
+class ArchiveTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.campaign = Campaign.objects.create(name="campaign")
+        self.exhausted = Voucher.objects.create_voucher('monetary', 100, self.user, campaign=self.campaign)
+        self.exhausted.redeem(self.user)
+        self.expired = Voucher.objects.create_voucher(
+            'monetary', 100, valid_until=timezone.now() - timedelta(days=100))
+        self.recently_expired = Voucher.objects.create_voucher(
+            'monetary', 100, valid_until=timezone.now() - timedelta(days=1))
+        self.active = Voucher.objects.create_voucher('monetary', 100, user_limit=2)
+        self.active.redeem(self.user)
+
+    def archive(self, **options):
+        call_command('archive_vouchers', stdout=StringIO(), **options)
+
+    def test_archive(self):
+        self.archive(batch_size=1)
+        self.assertEqual(
+            sorted(Voucher.objects.values_list('code', flat=True)),
+            sorted([self.recently_expired.code, self.active.code])
+        )
+        self.assertEqual(dict(ArchivedVoucher.objects.values_list('code', 'status')), {
+            self.exhausted.code: Voucher.EXHAUSTED,
+            self.expired.code: Voucher.EXPIRED,
+        })
+        archived = ArchivedVoucher.objects.get(code=self.exhausted.code)
+        self.assertEqual((archived.original_id, archived.campaign, archived.redeemed_count),
+                         (self.exhausted.pk, self.campaign, 1))
+        self.assertEqual(list(archived.users.values_list('user', flat=True)), [self.user.pk])
+        self.assertFalse(VoucherUser.objects.filter(voucher_id=self.exhausted.pk).exists())
+        self.assertEqual(ArchivedVoucherUser.objects.count(), 1)
+
+    def test_resume(self):
+        self.archive(limit=1, batch_size=1)
+        self.assertEqual(ArchivedVoucher.objects.count(), 1)
+        self.archive()
+        self.archive()
+        self.assertEqual(ArchivedVoucher.objects.count(), 2)
+        self.archive(days=0)
+        self.assertEqual(ArchivedVoucher.objects.count(), 3)
+
+    def test_failed_batch_is_rolled_back(self):
+        with mock.patch('vouchers.models.ArchivedVoucherUser.objects.bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.archive()
+        self.assertEqual(ArchivedVoucher.objects.count(), 0)
+        self.assertEqual(Voucher.objects.count(), 4)
+
+    def test_lookup(self):
+        self.archive()
+        codes = [self.exhausted.code, self.expired.code]
+        self.assertEqual(validate_codes(codes, self.user), dict.fromkeys(codes, "This code is not valid."))
+        with mock.patch('vouchers.validation.ARCHIVE_LOOKUP', True), mock.patch('vouchers.forms.ARCHIVE_LOOKUP', True):
+            self.assertEqual(validate_codes(codes + ["missing"], self.user), {
+                self.exhausted.code: "This code has already been used.",
+                self.expired.code: "This code is expired.",
+                "missing": "This code is not valid.",
+            })
+            form = VoucherForm(data={'code': self.expired.code}, user=self.user)
+            self.assertFalse(form.is_valid())
+            self.assertEqual(form.errors, {'code': ["This code is expired."]})
+
+    def test_lookup_with_code_filter(self):
+        self.archive()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        patchers = [mock.patch(name, True) for name in (
+            'vouchers.bloom.CODE_FILTER', 'vouchers.validation.ARCHIVE_LOOKUP', 'vouchers.forms.ARCHIVE_LOOKUP',
+            'vouchers.management.commands.build_code_filter.ARCHIVE_LOOKUP')]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # the archived codes are no longer in the voucher table the filter is built from
+        call_command('build_code_filter', capacity=1000, stdout=StringIO())
+        self.assertEqual(validate_codes([self.expired.code], self.user), {self.expired.code: "This code is expired."})
+        form = VoucherForm(data={'code': self.exhausted.code}, user=self.user)
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors, {'code': ["This code has already been used."]})
+
+    def test_admin(self):
+        self.archive()
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "admin"))
+        response = self.client.get(reverse('admin:vouchers_archivedvoucher_changelist'), {'q': self.expired.code})
+        self.assertEqual(response.context['cl'].result_count, 1)
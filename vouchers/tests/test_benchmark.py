@@ -0,0 +1,38 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase
+
+class BenchmarkTestCase(TestCase):
+    def benchmark(self, **options):
+        # the test database is used as it is instead of a throwaway one
+        command = 'vouchers.management.commands.benchmark_vouchers.'
+        with mock.patch.object(connection.creation, 'create_test_db', return_value=connection.settings_dict['NAME']), \
+                mock.patch.object(connection.creation, 'destroy_test_db'), \
+                mock.patch(command + 'setup_test_environment'), mock.patch(command + 'teardown_test_environment'):
+            call_command('benchmark_vouchers', stdout=StringIO(), stderr=StringIO(), **options)
+
+    def test_benchmark(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        output = os.path.join(directory.name, 'report.json')
+        self.benchmark(sizes='30,40', calls=5, output=output)
+        with open(output) as f:
+            report = json.load(f)
+        results = report['results']
+        self.assertEqual(len(results), 12)
+        self.assertEqual(set(result['size'] for result in results), {30, 40})
+        redeem = [result for result in results if result['operation'] == 'redeem']
+        self.assertEqual([result['calls'] for result in redeem], [5, 5])
+        self.assertTrue(all(result['queries'] > 0 for result in redeem))
+
+    def test_too_small_sizes(self):
+        with self.assertRaisesMessage(CommandError, "at least 3 times --calls"):
+            self.benchmark(sizes='100', calls=60)
+        with self.assertRaisesMessage(CommandError, "comma separated numbers"):
+            self.benchmark(sizes='100,many', calls=5)
@@ -0,0 +1,111 @@
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from vouchers import bloom
+from vouchers.bloom import BloomFilter
+from vouchers.forms import VoucherForm
+from vouchers.models import Voucher
+
+class BloomFilterTestCase(TestCase):
+    def test_membership(self):
+        codes = Voucher.generate_codes(1000)
+        bloom_filter = BloomFilter(1000, 0.01)
+        bloom_filter.update(codes)
+        for code in codes:
+            self.assertIn(code, bloom_filter)
+        false_positives = sum(code in bloom_filter for code in Voucher.generate_codes(1000))
+        self.assertLess(false_positives, 50)
+
+    def test_serialization(self):
+        bloom_filter = BloomFilter(100, 0.01)
+        bloom_filter.add("foo")
+        other = BloomFilter.from_bytes(bloom_filter.to_bytes())
+        self.assertIn("foo", other)
+        other.add("bar")
+        bloom_filter.union(other)
+        self.assertIn("bar", bloom_filter)
+        with self.assertRaises(ValueError):
+            bloom_filter.union(BloomFilter(10, 0.01))
+
+
+class CodeFilterTestMixin(object):
+    def setUp(self):
+        patcher = mock.patch('vouchers.bloom.CODE_FILTER', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        self.voucher = Voucher.objects.create_voucher('monetary', 100)
+        call_command('build_code_filter', capacity=1000, stdout=StringIO())
+
+    def test_unknown_code(self):
+        form = VoucherForm(data={'code': 'foo'})
+        with self.assertNumQueries(0):
+            self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors, {'code': ['This code is not valid.']})
+        self.assertTrue(VoucherForm(data={'code': self.voucher.code}).is_valid())
+
+    def test_new_codes(self):
+        voucher = Voucher.objects.create_voucher('monetary', 100)
+        vouchers = Voucher.objects.create_vouchers(10, 'monetary', 100, bulk=True)
+        manual = Voucher.objects.create(type='monetary', value=100, code='manual')
+        for voucher in [voucher, manual] + vouchers:
+            self.assertTrue(bloom.might_exist(voucher.code))
+
+    def test_built_before_enabled(self):
+        with mock.patch('vouchers.bloom.CODE_FILTER', False):
+            vouchers = [Voucher.objects.create_voucher('monetary', 100)]
+            vouchers += Voucher.objects.create_vouchers(3, 'monetary', 100, bulk=True)
+            vouchers += Voucher.objects.create_vouchers(2, 'monetary', 100)
+            self.assertTrue(bloom.might_exist("unknown"))
+        for voucher in vouchers:
+            self.assertTrue(bloom.might_exist(voucher.code))
+
+    def test_one_write_per_transaction(self):
+        with mock.patch('vouchers.bloom._write', wraps=bloom._write) as write:
+            vouchers = Voucher.objects.create_vouchers(5, 'monetary', 100)
+            self.assertEqual(write.call_count, 1)
+            with transaction.atomic():
+                manual = Voucher.objects.create(type='monetary', value=100, code='manual')
+                Voucher.objects.create(type='monetary', value=100, code='other')
+                self.assertFalse(bloom.might_exist('manual'))
+            self.assertEqual(write.call_count, 2)
+        for voucher in [manual] + vouchers:
+            self.assertTrue(bloom.might_exist(voucher.code))
+
+    def test_bulk_collision_checks(self):
+        with CaptureQueriesContext(connection) as context:
+            Voucher.objects.create_vouchers(10, 'monetary', 100, bulk=True)
+        statements = [query['sql'].split()[0] for query in context]
+        # the codes are not checked before the insert, only the ids are read back on some backends
+        self.assertNotIn('SELECT', statements[:statements.index('INSERT')])
+
+
+class CacheCodeFilterTestCase(CodeFilterTestMixin, TransactionTestCase):
+    def test_lock_timeout(self):
+        cache.set(bloom.CACHE_KEY + ':lock', b"other writer", 30)
+        with self.assertRaises(TimeoutError):
+            with bloom._storage_lock(timeout=0.05):
+                pass
+        self.assertEqual(cache.get(bloom.CACHE_KEY + ':lock'), b"other writer")
+
+    def test_expired_lock(self):
+        with bloom._storage_lock():
+            # expired and taken by another writer meanwhile
+            cache.set(bloom.CACHE_KEY + ':lock', b"other writer", 30)
+        self.assertEqual(cache.get(bloom.CACHE_KEY + ':lock'), b"other writer")
+
+
+class FileCodeFilterTestCase(CodeFilterTestMixin, TransactionTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch('vouchers.bloom.CODE_FILTER_PATH', os.path.join(directory.name, 'codes.bloom'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super(FileCodeFilterTestCase, self).setUp()
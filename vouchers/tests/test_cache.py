@@ -0,0 +1,86 @@
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache as default_cache
+from django.test import TestCase, TransactionTestCase
+from vouchers import cache
+from vouchers.forms import VoucherForm
+from vouchers.models import Voucher, VoucherUser
+
+class CacheTestMixin(object):
+    def setUp(self):
+        for patcher in (
+            mock.patch('vouchers.cache.CACHE_ALIAS', 'default'),
+            mock.patch('vouchers.cache.LOCAL_CACHE_SIZE', 2),
+            mock.patch('vouchers.forms.CACHE_ALIAS', 'default'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        default_cache.clear()
+        cache.clear_local()
+        self.user = User.objects.create(username="user1")
+        self.voucher = Voucher.objects.create_voucher('monetary', 100)
+        cache.reset_stats()
+
+
+class VoucherCacheTestCase(CacheTestMixin, TestCase):
+    def test_read_through(self):
+        self.assertEqual(cache.get_voucher(self.voucher.code), self.voucher)
+        with self.assertNumQueries(0):
+            voucher = cache.get_voucher(self.voucher.code)
+        self.assertEqual((voucher.pk, voucher.code, voucher.value), (self.voucher.pk, self.voucher.code, 100))
+        cache.clear_local()
+        with self.assertNumQueries(0):
+            cache.get_voucher(self.voucher.code)
+        self.assertEqual(cache.stats(), {'local_hits': 1, 'hits': 1, 'misses': 1, 'invalidations': 0})
+        self.assertIsNone(cache.get_voucher("foo"))
+
+    def test_local_lru(self):
+        other = Voucher.objects.create_voucher('monetary', 100)
+        third = Voucher.objects.create_voucher('monetary', 100)
+        for voucher in (self.voucher, other, third):
+            cache.get_voucher(voucher.code)
+        cache.get_voucher(self.voucher.code)
+        self.assertEqual(cache.stats()['local_hits'], 0)
+
+    def test_invalidation(self):
+        cache.get_voucher(self.voucher.code)
+        self.voucher.value = 50
+        self.voucher.save()
+        self.assertEqual(cache.get_voucher(self.voucher.code).value, 50)
+        VoucherUser.objects.create(voucher=self.voucher, user=self.user)
+        cache.get_voucher(self.voucher.code).update_counters()
+        self.assertEqual(cache.get_voucher(self.voucher.code).bound_user_count, 1)
+
+    def test_renamed_code(self):
+        voucher = cache.get_voucher(self.voucher.code)
+        code = voucher.code
+        voucher.code = "renamed"
+        voucher.save()
+        self.assertIsNone(cache.get_voucher(code))
+        self.assertEqual(cache.get_voucher("renamed"), self.voucher)
+
+    def test_form(self):
+        form = VoucherForm(data={'code': self.voucher.code}, user=self.user)
+        self.assertTrue(form.is_valid())
+        form = VoucherForm(data={'code': self.voucher.code}, user=self.user)
+        with self.assertNumQueries(0):
+            self.assertTrue(form.is_valid())
+        self.assertEqual(form.voucher, self.voucher)
+
+    def test_form_bound_voucher(self):
+        other_user = User.objects.create(username="user2")
+        voucher = Voucher.objects.create_voucher('monetary', 100, self.user)
+        self.assertTrue(VoucherForm(data={'code': voucher.code}, user=self.user).is_valid())
+        form = VoucherForm(data={'code': voucher.code}, user=other_user)
+        with self.assertNumQueries(1):
+            self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors, {'code': ['This code is not valid for your account.']})
+
+
+class RedeemInvalidationTestCase(CacheTestMixin, TransactionTestCase):
+    def test_redeem(self):
+        self.assertTrue(VoucherForm(data={'code': self.voucher.code}, user=self.user).is_valid())
+        cache.get_voucher(self.voucher.code).redeem(self.user)
+        form = VoucherForm(data={'code': self.voucher.code}, user=self.user)
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors, {'code': ['This code has already been used.']})
@@ -1,9 +1,12 @@
 from datetime import timedelta
+from unittest import mock
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.test import TestCase
+from vouchers.codes import is_signed, signature
 from vouchers.forms import VoucherGenerationForm, VoucherForm
 from vouchers.models import Voucher, VoucherUser
+from vouchers.settings import CODE_CHARS
 
 class VoucherGenerationFormTestCase(TestCase):
     def test_form(self):
@@ -27,6 +30,13 @@ class VoucherFormTestCase(TestCase):
         form = VoucherForm(data=form_data, user=self.user)
         self.assertTrue(form.is_valid())
 
+    def test_single_query(self):
+        other_user = User.objects.create(username="user2")
+        for user in (self.user, other_user, None):
+            form = VoucherForm(data={'code': self.voucher.code}, user=user)
+            with self.assertNumQueries(1):
+                form.is_valid()
+
     def test_types(self):
         form_data = {'code': self.voucher.code}
         form = VoucherForm(data=form_data, user=self.user, types=('percentage',))
@@ -40,7 +50,9 @@ class VoucherFormTestCase(TestCase):
         self.assertFalse(form.is_valid())
 
     def test_reuse(self):
-        self.voucher.redeem()
+        # the only slot is bound to the user, so redeeming it without user must fail
+        self.assertFalse(self.voucher.redeem())
+        self.assertTrue(self.voucher.redeem(self.user))
         self.voucher.save()
 
         form_data = {'code': self.voucher.code}
@@ -70,3 +82,50 @@ class UnboundVoucherFormTestCase(TestCase):
         form = VoucherForm(data=form_data, user=self.user)
 
         self.assertTrue(form.is_valid())
+
+class SignedVoucherFormTestCase(TestCase):
+    def setUp(self):
+        for patcher in (mock.patch('vouchers.codes.SIGNED_CODES', True), mock.patch('vouchers.models.SIGNED_CODES', True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = User.objects.create(username="user1")
+        self.voucher = Voucher.objects.create_voucher('monetary', 100)
+
+    def test_signed_code(self):
+        self.assertTrue(is_signed(self.voucher.code))
+        form = VoucherForm(data={'code': self.voucher.code}, user=self.user)
+        self.assertTrue(form.is_valid())
+
+    def test_forged_code(self):
+        code = self.voucher.code
+        forged = code[:-1] + ("a" if code[-1] != "a" else "b")
+        form = VoucherForm(data={'code': forged}, user=self.user)
+        with self.assertNumQueries(0):
+            self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors, {'code': ['This code is not valid.']})
+
+    def test_signature_alphabet(self):
+        counts = dict.fromkeys(CODE_CHARS, 0)
+        for i in range(len(CODE_CHARS) * 500):
+            counts[signature(str(i))[0]] += 1
+        # a digest byte modulo 62 would favour the first 8 characters by a quarter
+        self.assertLess(sum(counts[char] for char in CODE_CHARS[:8]) / 8, 550)
+
+    def test_prefix_length(self):
+        # 15 characters, a separator and 6 for the signature leave 8 for the prefix
+        self.assertTrue(VoucherGenerationForm(data={
+            'quantity': 1, 'value': 42, 'type': 'monetary', 'prefix': "x" * 8}).is_valid())
+        form = VoucherGenerationForm(data={'quantity': 1, 'value': 42, 'type': 'monetary', 'prefix': "x" * 9})
+        self.assertEqual(form.errors, {'prefix': ["The prefix can be at most 8 characters long."]})
+        with self.assertRaises(ValueError):
+            Voucher.generate_codes(1, "x" * 9)
+        self.assertEqual(len(Voucher.generate_codes(1, "x" * 8)[0]), 30)
+
+    def test_unsigned_code(self):
+        voucher = Voucher.objects.create(type='monetary', value=100, code="unsigned")
+        form = VoucherForm(data={'code': voucher.code}, user=self.user)
+        self.assertTrue(form.is_valid())
+        with mock.patch('vouchers.codes.ACCEPT_UNSIGNED_CODES', False):
+            form = VoucherForm(data={'code': voucher.code}, user=self.user)
+            with self.assertNumQueries(0):
+                self.assertFalse(form.is_valid())
@@ -0,0 +1,57 @@
+from unittest import skipUnless
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase
+from django.utils import timezone
+from vouchers.models import Campaign, Voucher, VoucherUser
+
+@skipUnless(connection.vendor in ('sqlite', 'postgresql'), "The plans are only checked on SQLite and PostgreSQL.")
+class IndexTestCase(TestCase):
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # the planner prefers scans on the tiny test tables
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        self.campaign = Campaign.objects.create(name="campaign")
+        self.voucher = Voucher.objects.create_voucher('monetary', 100, campaign=self.campaign, user_limit=0)
+        # mostly redeemed voucher users and a few pending ones, with statistics like a live database
+        User.objects.bulk_create([User(username="user%d" % i) for i in range(11)])
+        self.users = list(User.objects.order_by('pk'))
+        others = Voucher.objects.create_vouchers(20, 'monetary', 100, bulk=True)
+        VoucherUser.objects.bulk_create([
+            VoucherUser(voucher=voucher, user=user, redeemed_at=timezone.now())
+            for voucher in [self.voucher] + others for user in self.users[1:11]
+        ])
+        VoucherUser.objects.create(voucher=self.voucher)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE %s" % connection.ops.quote_name(VoucherUser._meta.db_table))
+
+    def assertUsesIndex(self, queryset, name):
+        plan = queryset.explain()
+        self.assertIn(name, plan, "%s not in:\n%s" % (name, plan))
+
+    def test_expired(self):
+        self.assertUsesIndex(Voucher.objects.expired(), 'voucher_valid_until_idx')
+
+    def test_campaign(self):
+        self.assertUsesIndex(
+            Voucher.objects.filter(campaign=self.campaign).order_by('created_at'), 'voucher_campaign_created_idx')
+
+    def test_used_unused(self):
+        for queryset in (Voucher.objects.used(), Voucher.objects.unused()):
+            self.assertUsesIndex(queryset, 'voucheruser_pending_idx')
+        self.assertUsesIndex(Voucher.objects.redeemed(), 'voucheruser_redeemed_idx')
+
+    def test_voucher_users(self):
+        self.assertUsesIndex(self.voucher.users.filter(redeemed_at__isnull=False), 'voucheruser_redeemed_idx')
+        self.assertUsesIndex(self.voucher.users.filter(redeemed_at__isnull=True), 'voucheruser_pending_idx')
+        # the slots ``redeem_many`` claims
+        self.assertUsesIndex(
+            VoucherUser.objects.filter(voucher__in=[self.voucher], redeemed_at__isnull=True).filter(
+                Q(user=self.users[0]) | Q(user__isnull=True)),
+            'voucheruser_pending_idx'
+        )
+        # the unbound slots ``Voucher.redeem`` claims
+        self.assertUsesIndex(
+            self.voucher.users.filter(user__isnull=True, redeemed_at__isnull=True), 'voucheruser_unbound_idx')
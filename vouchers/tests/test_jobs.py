@@ -0,0 +1,96 @@
+import csv
+
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from vouchers.models import Campaign, GenerationJob, Voucher
+
+class GenerationJobTestCase(TestCase):
+    def setUp(self):
+        self.campaign = Campaign.objects.create(name="campaign")
+
+    def create_job(self, quantity=7):
+        return GenerationJob.objects.create(quantity=quantity, type='monetary', value=10, campaign=self.campaign)
+
+    def test_run(self):
+        job = self.create_job()
+        self.assertEqual(GenerationJob.claim().pk, job.pk)
+        self.assertIsNone(GenerationJob.claim())
+        job.refresh_from_db()
+        job.run(batch_size=3)
+        job.refresh_from_db()
+        self.assertEqual(job.status, GenerationJob.DONE)
+        self.assertEqual(job.generated, 7)
+        self.assertEqual(job.vouchers.filter(campaign=self.campaign).count(), 7)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_resume_stale_job(self):
+        job = self.create_job()
+        Voucher.objects.create_vouchers(4, 'monetary', 10, bulk=True)
+        Voucher.objects.update(job=job)
+        GenerationJob.objects.filter(pk=job.pk).update(
+            status=GenerationJob.RUNNING, updated_at=timezone.now() - timedelta(hours=1))
+        self.assertIsNone(GenerationJob.claim(stale_after=7200))
+        job = GenerationJob.claim(stale_after=60)
+        job.run()
+        self.assertEqual(job.vouchers.count(), 7)
+        self.assertEqual(job.generated, 7)
+
+    def test_failure(self):
+        job = self.create_job()
+        with mock.patch.object(Voucher.objects, 'create_voucher_batches', side_effect=ValueError("exhausted")):
+            job.run()
+        job.refresh_from_db()
+        self.assertEqual(job.status, GenerationJob.FAILED)
+        self.assertIn("exhausted", job.error)
+
+    def test_command(self):
+        self.create_job(3)
+        self.create_job(2)
+        call_command('process_voucher_jobs', once=True, stdout=StringIO())
+        self.assertEqual(GenerationJob.objects.filter(status=GenerationJob.DONE).count(), 2)
+        self.assertEqual(Voucher.objects.count(), 5)
+
+class GenerationJobAdminTestCase(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "admin"))
+        patcher = mock.patch('vouchers.admin.BACKGROUND_THRESHOLD', 5)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_enqueue_and_download(self):
+        response = self.client.post(reverse('admin:generate_vouchers'), {'quantity': 5, 'value': 1, 'type': 'monetary'})
+        job = GenerationJob.objects.get()
+        self.assertRedirects(response, reverse('admin:vouchers_generationjob_progress', args=[job.pk]))
+        self.assertEqual(Voucher.objects.count(), 0)
+
+        url = reverse('admin:vouchers_generationjob_download', args=[job.pk, 'csv'])
+        response = self.client.get(response.url)
+        self.assertEqual(response.context['refresh'], 2)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        GenerationJob.claim().run()
+        response = self.client.get(reverse('admin:vouchers_generationjob_progress', args=[job.pk]))
+        self.assertIsNone(response.context['refresh'])
+        self.assertEqual(response.context['percent'], 100)
+        self.assertContains(response, url)
+        rows = list(csv.reader(b"".join(self.client.get(url).streaming_content).decode().splitlines()))
+        self.assertEqual(sorted(row[1] for row in rows[1:]), sorted(Voucher.objects.values_list('code', flat=True)))
+
+    def test_download_above_threshold(self):
+        response = self.client.post(reverse('admin:generate_vouchers'), {
+            'quantity': 5, 'value': 1, 'type': 'monetary', 'output': 'csv'})
+        rows = list(csv.reader(b"".join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(len(rows), 6)
+        self.assertFalse(GenerationJob.objects.exists())
+        self.assertEqual(Voucher.objects.count(), 5)
+
+    def test_changelist(self):
+        GenerationJob.objects.create(quantity=5, type='monetary', value=1)
+        response = self.client.get(reverse('admin:vouchers_generationjob_changelist'))
+        self.assertContains(response, reverse('admin:vouchers_generationjob_progress', args=[1]))
@@ -0,0 +1,41 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.test import TransactionTestCase
+from django.utils import timezone
+from vouchers.models import Voucher, VoucherUser
+
+class LoadTestTestCase(TransactionTestCase):
+    def setUp(self):
+        call_command('seed_vouchers', vouchers=50, users=20, campaigns=2, stdout=StringIO())
+
+    def loadtest(self, **options):
+        options = dict({'workers': 3, 'duration': 0.3, 'codes': 5, 'users': 10}, **options)
+        stdout = StringIO()
+        call_command('loadtest_vouchers', stdout=stdout, stderr=StringIO(), **options)
+        return stdout.getvalue()
+
+    def test_loadtest(self):
+        redeemed = VoucherUser.objects.filter(redeemed_at__isnull=False).count()
+        output = self.loadtest()
+        self.assertRegex(output, r"\d+ attempts in [\d.]+s: [\d.]+/s, [\d.]+ redemptions/s")
+        self.assertRegex(output, r"Latency p50 [\d.]+ms, p95 [\d.]+ms, p99 [\d.]+ms")
+        self.assertIn("Over-redeemed vouchers: 0, counter drift: 0, unaccounted redemptions: 0", output)
+        self.assertGreater(VoucherUser.objects.filter(redeemed_at__isnull=False).count(), redeemed)
+
+    def test_over_redemption(self):
+        def redeem_twice(code, user):
+            # bypasses the guarded statements of ``Voucher.redeem``
+            voucher = Voucher.objects.get(code=code)
+            VoucherUser.objects.create(voucher=voucher, redeemed_at=timezone.now())
+            return 'redeemed'
+
+        with mock.patch('vouchers.management.commands.loadtest_vouchers.attempt', redeem_twice):
+            with self.assertRaisesMessage(CommandError, "did not hold under load"):
+                self.loadtest(workers=1)
+
+    def test_empty_database(self):
+        Voucher.objects.all().delete()
+        with self.assertRaisesMessage(CommandError, "fill the database with seed_vouchers"):
+            self.loadtest()
@@ -0,0 +1,134 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from vouchers import metrics, profiling
+from vouchers.forms import VoucherForm
+from vouchers.models import Campaign, Voucher
+from vouchers.validation import validate_codes
+
+class MetricsMixin(object):
+    def setUp(self):
+        patcher = mock.patch('vouchers.metrics.METRICS', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.user = User.objects.create(username="user1")
+
+
+class RedemptionMetricsTestCase(MetricsMixin, TransactionTestCase):
+    def test_redemptions(self):
+        campaign = Campaign.objects.create(name="Spring")
+        vouchers = Voucher.objects.create_vouchers(3, 'monetary', 100, campaign=campaign)
+        vouchers[0].redeem(self.user)
+        Voucher.objects.redeem_many([voucher.code for voucher in vouchers[1:]], self.user)
+        Voucher.objects.create_voucher('percentage', 10).redeem(self.user)
+        text = metrics.render()
+        self.assertIn('vouchers_redemptions_total{campaign="%d",type="monetary"} 3\n' % campaign.pk, text)
+        self.assertIn('vouchers_redemptions_total{campaign="",type="percentage"} 1\n', text)
+
+
+class MetricsTestCase(MetricsMixin, TestCase):
+    def test_validation_outcomes(self):
+        voucher = Voucher.objects.create_voucher('monetary', 100)
+        self.assertTrue(VoucherForm(data={'code': voucher.code}, user=self.user).is_valid())
+        self.assertFalse(VoucherForm(data={'code': "missing"}, user=self.user).is_valid())
+        voucher.redeem(self.user)
+        validate_codes([voucher.code, "missing"], self.user)
+        text = metrics.render()
+        self.assertIn('vouchers_validations_total{outcome="valid"} 1\n', text)
+        self.assertIn('vouchers_validations_total{outcome="invalid"} 2\n', text)
+        self.assertIn('vouchers_validations_total{outcome="used"} 1\n', text)
+        self.assertIn("# TYPE vouchers_validations_total counter\n", text)
+
+    def test_disabled(self):
+        with mock.patch('vouchers.metrics.METRICS', False):
+            metrics.inc('vouchers_code_collisions_total')
+            self.assertEqual(self.client.get(reverse('vouchers:metrics')).status_code, 404)
+        self.assertEqual(metrics.snapshot(), {})
+
+    def test_collisions(self):
+        taken = Voucher.objects.create_voucher('monetary', 100).code
+        with mock.patch.object(Voucher, 'generate_codes', side_effect=[[taken, "FRESH1"], ["FRESH2"]]):
+            Voucher.objects.create_vouchers(2, 'monetary', 100, bulk=True)
+        self.assertIn("vouchers_code_collisions_total 1\n", metrics.render())
+
+    def test_latency_histogram(self):
+        Voucher.objects.create_voucher('monetary', 100).redeem(self.user)
+        metrics.observe('vouchers_operation_seconds', 0.003, (('operation', 'redeem'),))
+        text = metrics.render()
+        self.assertIn('vouchers_operation_seconds_bucket{operation="redeem",le="0.001"} ', text)
+        self.assertIn('vouchers_operation_seconds_bucket{operation="redeem",le="+Inf"} 2\n', text)
+        self.assertIn('vouchers_operation_seconds_count{operation="redeem"} 2\n', text)
+        self.assertNotIn('operation="create_voucher"', text)
+        self.assertEqual(profiling.sinks, [])  # timed without profiling the queries
+        buckets = [int(line.rsplit(" ", 1)[1]) for line in text.splitlines() if line.startswith(
+            'vouchers_operation_seconds_bucket')]
+        self.assertEqual(buckets, sorted(buckets))  # cumulative
+
+    def test_view(self):
+        metrics.inc('vouchers_code_collisions_total', amount=2)
+        response = self.client.get(reverse('vouchers:metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn(b"vouchers_code_collisions_total 2\n", response.content)
+
+    def test_merge_processes(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        patcher = mock.patch('vouchers.metrics.METRICS_DIR', directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        with open(os.path.join(directory, '1-other.json'), 'w') as f:
+            json.dump([
+                ['vouchers_code_collisions_total', [], 3],
+                ['vouchers_operation_seconds', [['operation', 'redeem']], [1] + [0] * 12 + [0.0005]],
+            ], f)
+        metrics.inc('vouchers_code_collisions_total')
+        metrics.observe('vouchers_operation_seconds', 0.0005, (('operation', 'redeem'),))
+        metrics.flush()
+        self.assertEqual(len(os.listdir(directory)), 2)
+        text = metrics.render()
+        self.assertIn("vouchers_code_collisions_total 4\n", text)
+        self.assertIn('vouchers_operation_seconds_count{operation="redeem"} 2\n', text)
+        self.assertIn('vouchers_operation_seconds_sum{operation="redeem"} 0.001\n', text)
+
+    def test_threads_share_totals(self):
+        threads = [threading.Thread(target=metrics.inc, args=('vouchers_code_collisions_total',)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(metrics.snapshot(), {('vouchers_code_collisions_total', ()): 20})
+        # the dicts of finished threads are folded into the totals of the process
+        self.assertTrue(all(thread.is_alive() for thread, values in metrics._threads))
+        self.assertEqual(metrics.snapshot(), {('vouchers_code_collisions_total', ()): 20})
+
+    def test_publish_without_requests(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for patcher in (mock.patch('vouchers.metrics.METRICS_DIR', directory),
+                        mock.patch('vouchers.metrics.METRICS_FLUSH_INTERVAL', 0.01),
+                        mock.patch.dict(metrics._process, pid=None)):  # a new process
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        metrics.inc('vouchers_code_collisions_total')
+        # the totals are written without another recording
+        deadline = time.time() + 5
+        while not any(name.endswith('.json') for name in os.listdir(directory)) and time.time() < deadline:
+            time.sleep(0.01)
+        path = os.path.join(directory, metrics._file_name())
+        with open(path) as f:
+            self.assertEqual(json.load(f), [['vouchers_code_collisions_total', [], 1]])
+
+        os.remove(path)
+        metrics._flush_at_exit()
+        self.assertTrue(os.path.exists(path))
@@ -1,14 +1,23 @@
 import re
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
 from django.utils import timezone
-from django.test import TestCase
-from vouchers.models import Voucher, Campaign
+from django.test import TestCase, TransactionTestCase
+from vouchers.codes import Permutation, random_strings, segment
+from vouchers.models import CODE_RETRIES, Voucher, VoucherUser, Campaign, CodeSequence
 from vouchers.settings import (
     CODE_LENGTH,
     CODE_CHARS,
     SEGMENT_LENGTH,
     SEGMENT_SEPARATOR,
+    SEQUENCE_BLOCK_SIZE,
 )
 
 class VoucherTestCase(TestCase):
@@ -30,6 +39,39 @@ class VoucherTestCase(TestCase):
             )
         )
 
+    def test_generate_codes(self):
+        codes = Voucher.generate_codes(1000, "prefix-")
+        self.assertEqual(len(set(codes)), 1000)
+        for code in codes:
+            self.assertIsNotNone(re.match("^prefix-[%s]{%d}$" % (CODE_CHARS, CODE_LENGTH,), code))
+
+    def test_generate_codes_segmented(self):
+        for code in Voucher.generate_codes(10, "", True):
+            self.assertEqual(code, segment(code.replace(SEGMENT_SEPARATOR, "")))
+
+    def test_generate_codes_alphabets(self):
+        self.assertEqual(len(set(random_strings(256, 8, "ab"))), 256)
+        for code in random_strings(100, 20, "\u00e4\u0101"):
+            self.assertIsNotNone(re.match("^[\u00e4\u0101]{20}$", code))
+        with mock.patch('vouchers.codes.numpy', None):
+            for code in random_strings(100, 20, "\u00e4\u0101"):
+                self.assertIsNotNone(re.match("^[\u00e4\u0101]{20}$", code))
+
+    def test_generate_codes_sequence(self):
+        with mock.patch('vouchers.models.CODE_STRATEGY', 'sequence'):
+            codes = Voucher.generate_codes(50, "prefix-")
+            vouchers = Voucher.objects.create_vouchers(50, 'monetary', 100, bulk=True)
+        self.assertEqual(len(set(codes + [voucher.code for voucher in vouchers])), 100)
+        for code in codes:
+            self.assertIsNotNone(re.match("^prefix-[%s]{%d}$" % (CODE_CHARS, CODE_LENGTH,), code))
+
+    def test_sequence_skips_existing_codes(self):
+        taken = Voucher.objects.create(type='monetary', value=100, code="TAKEN1").code  # e.g. from the random strategy
+        with mock.patch('vouchers.models.CODE_STRATEGY', 'sequence'), \
+                mock.patch.object(Voucher, 'generate_codes', side_effect=[[taken, "SEQ1"], ["SEQ2"]]):
+            vouchers = Voucher.objects.create_vouchers(2, 'monetary', 100, bulk=True)
+        self.assertEqual(sorted(voucher.code for voucher in vouchers), ["SEQ1", "SEQ2"])
+
     def test_save(self):
         voucher = Voucher(type='monetary', value=100)
         voucher.save()
@@ -44,11 +86,123 @@ class VoucherTestCase(TestCase):
         for voucher in vouchers:
             self.assertTrue(voucher.pk)
 
+    def test_create_voucher_retry(self):
+        taken = Voucher.objects.create_voucher('monetary', 100).code
+        with mock.patch.object(Voucher, 'generate_code', side_effect=[taken, 'free']):
+            voucher = Voucher.objects.create_voucher('monetary', 100, user_limit=5)
+        self.assertEqual(voucher.code, 'free')
+        self.assertEqual(voucher.user_limit, 5)
+
+    def test_create_voucher_retries_bounded(self):
+        taken = Voucher.objects.create_voucher('monetary', 100).code
+        with mock.patch.object(Voucher, 'generate_code', return_value=taken) as generate_code:
+            with self.assertRaises(IntegrityError):
+                Voucher.objects.create_voucher('monetary', 100)
+        self.assertEqual(generate_code.call_count, CODE_RETRIES + 1)
+        # any other constraint is not retried
+        with mock.patch.object(type(Voucher.objects), 'create', side_effect=IntegrityError) as create:
+            with self.assertRaises(IntegrityError):
+                Voucher.objects.create_voucher('monetary', 100)
+        self.assertEqual(create.call_count, 1)
+
+    def test_create_vouchers_bulk(self):
+        campaign = Campaign.objects.create(name="bulk")
+        vouchers = Voucher.objects.create_vouchers(
+            120, 'monetary', 100, campaign=campaign, user_limit=3, bulk=True, batch_size=50)
+        self.assertEqual(len(vouchers), 120)
+        self.assertEqual(len(set(voucher.code for voucher in vouchers)), 120)
+        for voucher in vouchers:
+            self.assertTrue(voucher.pk)
+        self.assertEqual(Voucher.objects.filter(campaign=campaign, user_limit=3).count(), 120)
+
+    def test_create_vouchers_bulk_collision(self):
+        taken = Voucher.objects.create_voucher('monetary', 100).code
+        with mock.patch.object(Voucher, 'generate_codes', side_effect=[[taken, 'a'], ['b']]):
+            vouchers = Voucher.objects.create_vouchers(2, 'monetary', 100, bulk=True)
+        self.assertEqual(sorted(voucher.code for voucher in vouchers), ['a', 'b'])
+
+    def test_create_vouchers_bulk_concurrent_collision(self):
+        taken = Voucher.objects.create_voucher('monetary', 100).code
+        # another process inserted the code after it was checked
+        with mock.patch.object(Voucher.objects, '_free_codes', side_effect=[{taken, 'a'}, {'b', 'c'}]):
+            vouchers = Voucher.objects.create_vouchers(2, 'monetary', 100, bulk=True)
+        self.assertEqual(sorted(voucher.code for voucher in vouchers), ['b', 'c'])
+        self.assertFalse(Voucher.objects.filter(code='a').exists())
+
+    def test_create_vouchers_bulk_other_integrity_error(self):
+        # nothing took the codes, so new codes would fail the same way
+        with mock.patch.object(Voucher.objects, 'bulk_create', side_effect=IntegrityError("FOREIGN KEY")):
+            with self.assertRaises(IntegrityError):
+                Voucher.objects.create_vouchers(2, 'monetary', 100, bulk=True)
+
+    def test_create_vouchers_bulk_retries(self):
+        taken = Voucher.objects.create_voucher('monetary', 100).code
+        with mock.patch.object(Voucher.objects, '_free_codes', return_value={taken}) as free_codes:
+            with self.assertRaises(IntegrityError):
+                Voucher.objects.create_vouchers(1, 'monetary', 100, bulk=True)
+        self.assertEqual(free_codes.call_count, CODE_RETRIES + 1)
+
+    def test_generate_vouchers_command(self):
+        campaign = Campaign.objects.create(name="partner")
+        out = StringIO()
+        call_command('generate_vouchers', 25, 'percentage', 10, campaign=campaign.pk, prefix="P-",
+                     valid_until="2030-01-01 12:00", workers=1, chunk_size=10, batch_size=4, stdout=out)
+        vouchers = Voucher.objects.filter(campaign=campaign, type='percentage', code__startswith="P-")
+        self.assertEqual(vouchers.count(), 25)
+        self.assertEqual(vouchers.filter(valid_until__year=2030).count(), 25)
+        self.assertIn("codes/s", out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('generate_vouchers', 5, 'unknown', 10, workers=1)
+
     def test_redeem(self):
         voucher = Voucher.objects.create_voucher('monetary', 100)
         voucher.redeem()
         self.assertIsNotNone(voucher.redeemed_at)
 
+    def test_counters(self):
+        users = [User.objects.create(username="user%s" % i) for i in range(3)]
+        voucher = Voucher.objects.create_voucher('monetary', 100, users[:1], user_limit=3)
+        self.assertEqual((voucher.redeemed_count, voucher.bound_user_count), (0, 1))
+        voucher.redeem(users[0])
+        VoucherUser.objects.create(voucher=voucher)
+        voucher.redeem(users[1])
+        voucher.redeem(users[2])
+        self.assertEqual((voucher.redeemed_count, voucher.bound_user_count), (3, 3))
+        voucher.refresh_from_db()
+        self.assertEqual((voucher.redeemed_count, voucher.bound_user_count), (3, 3))
+        with self.assertNumQueries(0):
+            self.assertTrue(voucher.is_redeemed)
+
+    def test_save_keeps_counters(self):
+        user = User.objects.create(username="user")
+        voucher = Voucher.objects.create_voucher('monetary', 100, user_limit=2)
+        stale = Voucher.objects.get(pk=voucher.pk)
+        voucher.redeem(user)
+        stale.value = 200
+        stale.save()
+        voucher.refresh_from_db()
+        self.assertEqual((voucher.value, voucher.redeemed_count, voucher.bound_user_count), (200, 1, 1))
+
+    def test_deleted_user_counters(self):
+        users = [User.objects.create(username="user%s" % i) for i in range(2)]
+        voucher = Voucher.objects.create_voucher('monetary', 100, users, user_limit=2)
+        voucher.redeem(users[0])
+        users[0].delete()
+        voucher.refresh_from_db()
+        self.assertEqual((voucher.redeemed_count, voucher.bound_user_count), (0, 1))
+        users[1].delete()
+        voucher.refresh_from_db()
+        self.assertEqual((voucher.redeemed_count, voucher.bound_user_count), (0, 0))
+
+    def test_rebuild_counters(self):
+        user = User.objects.create(username="user")
+        voucher = Voucher.objects.create_voucher('monetary', 100, user)
+        voucher.redeem(user)
+        Voucher.objects.update(redeemed_count=5, bound_user_count=0)
+        call_command('rebuild_voucher_counters', batch_size=1, stdout=StringIO())
+        voucher.refresh_from_db()
+        self.assertEqual((voucher.redeemed_count, voucher.bound_user_count), (1, 1))
+
     def test_expired(self):
         voucher = Voucher.objects.create_voucher('monetary', 100)
         self.assertFalse(voucher.expired())
@@ -75,9 +229,98 @@ class VoucherTestCase(TestCase):
         self.assertEqual(Voucher.objects.used().count(), 1)
         self.assertEqual(Voucher.objects.unused().count(), 0)
 
+    def test_used_partially(self):
+        users = [User.objects.create(username="user%s" % i) for i in range(2)]
+        voucher = Voucher.objects.create_voucher('monetary', 100, users, user_limit=3)
+        self.assertEqual(list(Voucher.objects.unused()), [voucher])
+        voucher.redeem(users[0])
+        voucher.redeem(users[1])
+        self.assertEqual(list(Voucher.objects.used()), [voucher])  # once, although redeemed twice
+        self.assertEqual(Voucher.objects.unused().count(), 0)
+
+    def test_used_by_some_users(self):
+        users = [User.objects.create(username="user%s" % i) for i in range(2)]
+        voucher = Voucher.objects.create_voucher('monetary', 100, users, user_limit=2)
+        voucher.redeem(users[0])
+        # used only once all bound users redeemed it
+        self.assertEqual(Voucher.objects.used().count(), 0)
+        self.assertEqual(list(Voucher.objects.unused()), [voucher])
+        self.assertEqual(list(Voucher.objects.redeemed()), [voucher])
+        voucher.redeem(users[1])
+        self.assertEqual(list(Voucher.objects.used()), [voucher])
+        self.assertEqual(list(Voucher.objects.redeemed()), [voucher])  # once, although redeemed twice
+
+    def test_with_status(self):
+        active = Voucher.objects.create_voucher('monetary', 100, user_limit=0)
+        active.redeem()
+        exhausted = Voucher.objects.create_voucher('monetary', 100)
+        exhausted.redeem()
+        expired = Voucher.objects.create_voucher('monetary', 100, valid_until=timezone.now() - timedelta(days=1))
+        expired.redeem()
+        with self.assertNumQueries(1):
+            statuses = dict(Voucher.objects.with_status().values_list('code', 'status'))
+        self.assertEqual(statuses, {
+            active.code: Voucher.ACTIVE,
+            exhausted.code: Voucher.EXHAUSTED,
+            expired.code: Voucher.EXPIRED,
+        })
+
+
+class CodeSequenceTestCase(TestCase):
+    def test_reserve(self):
+        self.assertEqual(CodeSequence.reserve(10), range(0, 10))
+        self.assertEqual(CodeSequence.reserve(5), range(10, 15))
+        self.assertEqual(CodeSequence.reserve(5, 'other'), range(0, 5))
+
+    def test_take_inside_transaction(self):
+        self.assertEqual(CodeSequence.take(3), [0, 1, 2])
+        self.assertEqual(CodeSequence.take(2), [3, 4])
+        self.assertEqual(CodeSequence.objects.get(name='codes').value, 5)
+
+    def test_permutation(self):
+        permutation = Permutation("key", 5, "abc")
+        codes = set(permutation.code(number) for number in range(3 ** 5))
+        self.assertEqual(len(codes), 3 ** 5)
+        for number in range(3 ** 5):
+            self.assertEqual(permutation.decrypt(permutation.encrypt(number)), number)
+        self.assertNotEqual(permutation.code(0), Permutation("other key", 5, "abc").code(0))
+        with self.assertRaises(ValueError):
+            permutation.code(3 ** 5)
+
+
+class SequenceConnectionTestCase(TransactionTestCase):
+    def test_take_from_second_connection(self):
+        self.addCleanup(CodeSequence._blocks.clear)
+        # as on backends with concurrent writers, the block is reserved on a connection of its own, and kept since a
+        # rollback of the caller cannot hand it out again
+        with mock.patch.object(connection, 'vendor', 'postgresql'), self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.assertTrue(CodeSequence.keeps_blocks())
+                self.assertEqual(CodeSequence.take(3), [0, 1, 2])
+                self.assertEqual(CodeSequence.reserve(5), range(SEQUENCE_BLOCK_SIZE, SEQUENCE_BLOCK_SIZE + 5))
+                raise RuntimeError
+        self.assertEqual(CodeSequence.objects.get(name='codes').value, SEQUENCE_BLOCK_SIZE + 5)
+        self.assertEqual(CodeSequence.take(2), [3, 4])
+
 
 class CampaignTestCase(TestCase):
     def test_str(self):
         campaign = Campaign(name="test")
         campaign.save()
         self.assertEqual("test", str(campaign))
+
+
+class GenerateVouchersWorkersTestCase(TransactionTestCase):
+    def test_workers(self):
+        campaign = Campaign.objects.create(name="partner")
+        out = StringIO()
+        # worker processes cannot share the in-memory test database, which locks whole tables against concurrent
+        # writers, so the chunks run in the pool of a single thread
+        pool = lambda workers, initializer: ThreadPoolExecutor(1, initializer=initializer)  # noqa: E731
+        with mock.patch('vouchers.management.commands.generate_vouchers.ProcessPoolExecutor', pool):
+            call_command('generate_vouchers', 25, 'monetary', 10, campaign=campaign.pk, workers=3, chunk_size=4,
+                         batch_size=3, stdout=out)
+        self.assertEqual(Voucher.objects.filter(campaign=campaign).count(), 25)
+        self.assertEqual(len(set(Voucher.objects.values_list('code', flat=True))), 25)
+        self.assertIn("25/25 vouchers", out.getvalue())
+        self.assertIn("Generated 25 vouchers", out.getvalue())
@@ -0,0 +1,96 @@
+import socket
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+from vouchers import profiling
+from vouchers.admin import VoucherAdmin
+from vouchers.forms import VoucherForm
+from vouchers.models import Voucher
+
+class ProfilingTestCase(TestCase):
+    def setUp(self):
+        self.buffer = profiling.RingBufferSink(size=10)
+        profiling.add_sink(self.buffer)
+        self.addCleanup(profiling.remove_sink, self.buffer)
+        self.user = User.objects.create(username="user1")
+
+    def test_samples(self):
+        voucher = Voucher.objects.create_voucher('monetary', 100)
+        self.assertTrue(VoucherForm(data={'code': voucher.code}, user=self.user).is_valid())
+        voucher.redeem(self.user)
+        names = [sample.name for sample in self.buffer.samples()]
+        self.assertEqual(names, ['create_voucher', 'clean_code', 'redeem'])
+        clean_code = self.buffer.samples('clean_code')[0]
+        self.assertEqual(clean_code.queries, 1)
+        self.assertGreater(clean_code.seconds, clean_code.sql_seconds)
+        self.assertGreater(self.buffer.samples('redeem')[0].queries, 1)
+        self.assertEqual(connection.execute_wrappers, [])
+
+    def test_admin_views(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "admin"))
+        self.client.get(reverse('admin:vouchers_voucher_changelist'))
+        self.client.post(reverse('admin:generate_vouchers'), {'quantity': 2, 'value': 1, 'type': 'monetary'})
+        samples = self.buffer.samples()
+        self.assertEqual(
+            [sample.name for sample in samples],
+            ['admin.voucher_changelist', 'create_vouchers', 'admin.generate_vouchers']
+        )
+        # the changelist is rendered inside the profile, including the query for the result list
+        self.assertGreaterEqual(samples[0].queries, 2)
+
+    def test_lazy_rendering(self):
+        request = RequestFactory().get(reverse('admin:vouchers_voucher_changelist'))
+        request.user = User.objects.create_superuser("admin", "admin@example.com", "admin")
+        model_admin = VoucherAdmin(Voucher, admin.site)
+        self.assertTrue(model_admin.changelist_view(request).is_rendered)
+        profiling.remove_sink(self.buffer)
+        self.addCleanup(profiling.add_sink, self.buffer)
+        # left to the template response middleware when nothing is profiled
+        self.assertFalse(model_admin.changelist_view(request).is_rendered)
+
+    def test_ring_buffer(self):
+        for i in range(15):
+            with profiling.profile('block'):
+                pass
+        self.assertEqual(len(self.buffer.samples()), 10)
+        self.buffer.clear()
+        self.assertEqual(self.buffer.samples(), [])
+
+    def test_disabled(self):
+        profiling.remove_sink(self.buffer)
+        self.addCleanup(profiling.add_sink, self.buffer)
+        voucher = Voucher.objects.create_voucher('monetary', 100)
+        voucher.redeem(self.user)
+        self.assertEqual(self.buffer.samples(), [])
+
+    def test_configure(self):
+        self.addCleanup(profiling.sinks.__setitem__, slice(None), list(profiling.sinks))
+        profiling.configure(['log', 'statsd', 'vouchers.profiling.RingBufferSink'])
+        self.assertEqual(
+            [type(sink) for sink in profiling.sinks],
+            [profiling.LogSink, profiling.StatsdSink, profiling.RingBufferSink]
+        )
+
+    def test_log_sink(self):
+        profiling.add_sink(profiling.LogSink())
+        self.addCleanup(profiling.sinks.pop)
+        with self.assertLogs('vouchers.profiling') as logs:
+            Voucher.objects.create_voucher('monetary', 100)
+        self.assertRegex(logs.output[0], r"create_voucher took [\d.]+ms with \d+ queries")
+
+    def test_statsd_sink(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(listener.close)
+        listener.bind(('127.0.0.1', 0))
+        listener.settimeout(5)
+        profiling.add_sink(profiling.StatsdSink(listener.getsockname(), prefix='shop'))
+        self.addCleanup(profiling.sinks.pop)
+        with profiling.profile('block'):
+            User.objects.count()
+        lines = listener.recv(4096).decode().splitlines()
+        self.assertEqual(lines[0], "shop.block.calls:1|c")
+        self.assertEqual(lines[2], "shop.block.queries:1|c")
+        self.assertTrue(lines[1].startswith("shop.block.time:") and lines[1].endswith("|ms"))
@@ -0,0 +1,111 @@
+""" Query budgets of the public voucher operations, checked at growing numbers of vouchers, users and campaigns.
+
+Every budget is a constant, so an operation whose queries grow with the data fails at the larger sizes. Budgets of
+writes include the savepoint pair of ``transaction.atomic`` inside the test transaction.
+"""
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+from django.urls import reverse
+from vouchers.forms import VoucherForm
+from vouchers.models import ArchivedVoucher, Campaign, GenerationJob, Voucher, VoucherUser
+from vouchers.validation import validate_codes
+
+SIZES = (1, 10, 50)
+
+class QueryBudgetTestCase(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "admin")
+        self.user = User.objects.create(username="user")
+        self.size = 0
+
+    def grow(self, size):
+        """ Tops the data up to ``size`` campaigns, users and vouchers, half of them partially redeemed. """
+        for i in range(self.size, size):
+            campaign = Campaign.objects.create(name="campaign %d" % i)
+            user = User.objects.create(username="user%d" % i)
+            voucher = Voucher.objects.create_voucher('monetary', 100, campaign=campaign, user_limit=3)
+            if not i % 2:
+                voucher.redeem(user)
+                VoucherUser.objects.create(voucher=voucher, user=self.user)
+        GenerationJob.objects.create(quantity=size, type='monetary', value=100)
+        archived = Voucher.objects.create_vouchers(size - self.size, 'monetary', 100, bulk=True)
+        ArchivedVoucher.archive(Voucher.objects.with_status().filter(code__in=[voucher.code for voucher in archived]))
+        Voucher.objects.rebuild_counters()
+        self.size = size
+
+    def budgets(self):
+        """ Yields the name, query budget and callable of every operation, creating its objects beforehand. """
+        yield 'generate_code', 0, Voucher.generate_code
+        yield 'create_voucher', 3, lambda: Voucher.objects.create_voucher('monetary', 100)
+        yield 'create_vouchers', 7, lambda: Voucher.objects.create_vouchers(5, 'monetary', 100, bulk=True)
+        for voucher in (self.fresh(), self.redeemed(), self.bound()):
+            yield 'clean_code', 1, lambda: VoucherForm(data={'code': voucher.code}, user=self.user).is_valid()
+        yield 'clean_code missing', 1, lambda: VoucherForm(data={'code': "missing"}, user=self.user).is_valid()
+        voucher = self.fresh()
+        yield 'redeem', 11, lambda: voucher.redeem(self.user)
+        voucher = self.bound()
+        yield 'redeem bound', 4, lambda: voucher.redeem(self.user)  # the pending slot of the user
+        codes = [self.fresh().code, self.fresh().code]
+        yield 'redeem_many', 7, lambda: Voucher.objects.redeem_many(codes, self.user)
+        codes = [self.fresh().code, self.redeemed().code, "missing"]
+        yield 'validate_codes', 1, lambda: validate_codes(codes, self.user)
+        voucher = self.redeemed()
+        yield 'redeemed_at', 1, lambda: voucher.redeemed_at
+        yield 'used', 1, lambda: list(Voucher.objects.used())
+        yield 'unused', 1, lambda: list(Voucher.objects.unused())
+        yield 'redeemed', 1, lambda: list(Voucher.objects.redeemed())
+        yield 'with_status', 1, lambda: list(Voucher.objects.with_status())
+        yield 'with_user_state', 1, lambda: list(Voucher.objects.with_user_state(self.user))
+
+    def fresh(self):
+        return Voucher.objects.create_voucher('monetary', 100)
+
+    def redeemed(self):
+        voucher = self.fresh()
+        voucher.redeem(self.user)
+        return voucher
+
+    def bound(self):
+        return Voucher.objects.create_voucher('monetary', 100, self.user)
+
+    def test_operations(self):
+        for size in SIZES:
+            self.grow(size)
+            for name, budget, operation in self.budgets():
+                with self.subTest(size=size, operation=name):
+                    with self.assertNumQueries(budget):
+                        operation()
+
+    def test_admin_pages(self):
+        self.client.force_login(self.admin)
+        ContentType.objects.get_for_model(Voucher)  # cached for the rest of the process
+        for size in SIZES:
+            self.grow(size)
+            voucher = Voucher.objects.filter(redeemed_count__gt=0).first()
+            pages = [
+                (6, reverse('admin:vouchers_voucher_changelist')),
+                (6, reverse('admin:vouchers_voucher_changelist') + '?status=active'),
+                (8, reverse('admin:vouchers_voucher_change', args=[voucher.pk])),
+                (5, reverse('admin:vouchers_campaign_changelist')),
+                (5, reverse('admin:vouchers_generationjob_changelist')),
+                (6, reverse('admin:vouchers_archivedvoucher_changelist')),
+                (3, reverse('admin:generate_vouchers')),
+            ]
+            for budget, url in pages:
+                with self.subTest(size=size, url=url), self.assertNumQueries(budget):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_api(self):
+        self.client.force_login(self.user)
+        for size in SIZES:
+            self.grow(size)
+            codes = [voucher.code for voucher in Voucher.objects.create_vouchers(2, 'monetary', 100)]
+            requests = [
+                ('validate', 3, lambda: self.client.get(reverse('vouchers:validate'), {'code': codes + ["missing"]})),
+                ('redeem', 9, lambda: self.client.post(reverse('vouchers:redeem'), {'code': codes})),
+                ('status', 1, lambda: self.client.get(reverse('vouchers:status', args=[codes[0]]))),
+            ]
+            for name, budget, request in requests:
+                with self.subTest(size=size, view=name), self.assertNumQueries(budget):
+                    self.assertLess(request().status_code, 400)
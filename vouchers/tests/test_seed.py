@@ -0,0 +1,74 @@
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db.models import F
+from django.test import TestCase
+from vouchers.forms import VoucherForm
+from vouchers.models import Campaign, Voucher, VoucherUser, count_voucher_users
+
+class SeedTestCase(TestCase):
+    def seed(self, **options):
+        options = dict({'vouchers': 300, 'users': 40, 'campaigns': 5, 'batch_size': 100, 'seed': 1,
+                        'reference': '2026-01-01'}, **options)
+        call_command('seed_vouchers', stdout=StringIO(), stderr=StringIO(), **options)
+
+    def test_seed(self):
+        self.seed()
+        self.assertEqual(Voucher.objects.count(), 300)
+        self.assertEqual(User.objects.count(), 40)
+        self.assertEqual(Campaign.objects.count(), 5)
+        vouchers = Voucher.objects.annotate(
+            redeemed=count_voucher_users(redeemed_at__isnull=False),
+            bound=count_voucher_users(user__isnull=False),
+        )
+        self.assertFalse(vouchers.exclude(redeemed=F('redeemed_count')).exists())
+        self.assertFalse(vouchers.exclude(bound=F('bound_user_count')).exists())
+        self.assertFalse(Voucher.objects.filter(user_limit__gt=0, redeemed_count__gt=F('user_limit')).exists())
+        # every kind of voucher is there
+        self.assertEqual(set(Voucher.objects.values_list('user_limit', flat=True)) & {0, 1}, {0, 1})
+        self.assertTrue(Voucher.objects.filter(user_limit__gt=1, redeemed_count__gt=0).exists())
+        self.assertTrue(VoucherUser.objects.filter(redeemed_at__isnull=True).exists())  # bound, not redeemed
+        self.assertTrue(Voucher.objects.filter(valid_until__isnull=True).exists())
+        self.assertTrue(Voucher.objects.filter(campaign__isnull=True).exists())
+        self.assertEqual(
+            Voucher.objects.with_status().filter(status=Voucher.EXPIRED).count(), Voucher.objects.expired().count())
+
+        # the seeded vouchers work like generated ones
+        voucher = Voucher.objects.filter(user_limit=1, redeemed_count=0, bound_user_count=0,
+                                         valid_until__isnull=True).first()
+        user = User.objects.create(username="shopper")
+        self.assertTrue(VoucherForm(data={'code': voucher.code}, user=user).is_valid())
+        self.assertTrue(voucher.redeem(user))
+        self.assertEqual(Voucher.objects.create_voucher('monetary', 100).pk, Voucher.objects.order_by('pk').last().pk)
+
+    def test_deterministic(self):
+        self.seed()
+        first = list(Voucher.objects.order_by('pk').values_list(
+            'code', 'user_limit', 'valid_until', 'campaign__name', 'redeemed_count'))
+        redemptions = list(VoucherUser.objects.order_by('voucher__code', 'user__username').values_list(
+            'voucher__code', 'user__username', 'redeemed_at'))
+        Voucher.objects.all().delete()
+        User.objects.all().delete()
+        Campaign.objects.all().delete()
+        self.seed()
+        self.assertEqual(list(Voucher.objects.order_by('pk').values_list(
+            'code', 'user_limit', 'valid_until', 'campaign__name', 'redeemed_count')), first)
+        self.assertEqual(list(VoucherUser.objects.order_by('voucher__code', 'user__username').values_list(
+            'voucher__code', 'user__username', 'redeemed_at')), redemptions)
+
+    def test_seeds(self):
+        self.seed()
+        with self.assertRaisesMessage(CommandError, "already been seeded with seed 1"):
+            self.seed()
+        self.seed(seed=2, vouchers=10)
+        self.assertEqual(Voucher.objects.count(), 310)
+
+    def test_seeds_without_users(self):
+        self.seed(users=0)
+        with self.assertRaisesMessage(CommandError, "already been seeded with seed 1"):
+            self.seed(users=0)
+        self.seed(seed=2, users=0, campaigns=0, vouchers=10)
+        with self.assertRaisesMessage(CommandError, "already been seeded with seed 2"):
+            self.seed(seed=2, users=0, campaigns=0, vouchers=10)
+        self.assertEqual(Voucher.objects.count(), 310)
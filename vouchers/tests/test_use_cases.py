@@ -1,8 +1,11 @@
 from datetime import datetime
+from unittest import mock
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.db import IntegrityError, transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
 from vouchers.forms import VoucherForm
-from vouchers.models import Voucher
+from vouchers.models import REDEEM_RETRIES, Voucher, VoucherManager, VoucherUser, redeem_done, vouchers_redeemed
 
 class DefaultVoucherTestCase(TestCase):
     def setUp(self):
@@ -121,3 +124,138 @@ class UnlimitedVoucherTestCase(TestCase):
             form.errors,
             {'code': ['This code has already been used by your account.']}
         )
+
+
+class LimitedVoucherTestCase(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username="user%s" % i) for i in range(3)]
+        self.voucher = Voucher.objects.create_voucher('monetary', 100, self.users[0], user_limit=2)
+
+    def test_redeem_up_to_limit(self):
+        self.assertTrue(self.voucher.redeem(self.users[1]))
+        self.assertTrue(self.voucher.redeem(self.users[0]))
+        self.assertFalse(self.voucher.redeem(self.users[2]))
+        self.assertEquals(self.voucher.users.filter(redeemed_at__isnull=False).count(), 2)
+
+    def test_redeem_twice(self):
+        self.assertTrue(self.voucher.redeem(self.users[0]))
+        self.assertFalse(self.voucher.redeem(self.users[0]))
+
+    def test_redeem_unbound_slot(self):
+        VoucherUser.objects.create(voucher=self.voucher)
+        self.assertTrue(self.voucher.redeem(self.users[1]))
+        self.assertFalse(self.voucher.users.filter(user__isnull=True).exists())
+        self.assertFalse(self.voucher.redeem(self.users[2]))
+
+
+class RedeemManyTestCase(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username="user%s" % i) for i in range(2)]
+        self.single = Voucher.objects.create_voucher('monetary', 100)
+        self.bound = Voucher.objects.create_voucher('monetary', 100, self.users[0], user_limit=2)
+        self.unbound = Voucher.objects.create_voucher('percentage', 10, user_limit=3)
+        VoucherUser.objects.create(voucher=self.unbound)
+
+    def test_redeem_many(self):
+        codes = [self.single.code, self.bound.code, self.unbound.code]
+        with self.assertNumQueries(9):  # seven statements in the savepoint of the test transaction
+            results = Voucher.objects.redeem_many(codes, self.users[0])
+        self.assertEqual(results, dict.fromkeys(codes))
+        self.assertEqual(list(results), codes)
+        for voucher in (self.single, self.bound, self.unbound):
+            voucher.refresh_from_db()
+            self.assertEqual(voucher.redeemed_count, 1)
+            self.assertEqual(voucher.users.get(user=self.users[0]).redeemed_at is not None, True)
+        self.assertEqual([v.bound_user_count for v in (self.single, self.bound, self.unbound)], [1, 1, 1])
+        self.assertFalse(self.unbound.users.filter(user__isnull=True).exists())
+
+    def test_all_or_nothing(self):
+        self.single.redeem(self.users[1])
+        results = Voucher.objects.redeem_many([self.bound.code, self.single.code, "missing"], self.users[0])
+        self.assertEqual(results, {
+            self.bound.code: None,
+            self.single.code: "This code has already been used.",
+            "missing": "This code is not valid.",
+        })
+        self.assertFalse(VoucherUser.objects.filter(user=self.users[0], redeemed_at__isnull=False).exists())
+        self.bound.refresh_from_db()
+        self.assertEqual(self.bound.redeemed_count, 0)
+
+    def test_redeem_twice(self):
+        self.assertEqual(Voucher.objects.redeem_many([self.bound.code], self.users[0]), {self.bound.code: None})
+        self.assertEqual(
+            Voucher.objects.redeem_many([self.bound.code], self.users[0]),
+            {self.bound.code: "This code has already been used by your account."}
+        )
+
+    def test_no_free_slot(self):
+        VoucherUser.objects.create(voucher=self.bound, user=self.users[1], redeemed_at=timezone.now())
+        self.bound.update_counters()
+        other = User.objects.create(username="other")
+        self.assertEqual(
+            Voucher.objects.redeem_many([self.bound.code], other),
+            {self.bound.code: "This code is not valid for your account."}
+        )
+
+    def test_concurrent_claim(self):
+        claim_slots = VoucherManager._claim_slots
+        calls = []
+
+        def taken_once(manager, *args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise IntegrityError("A pending voucher user was redeemed concurrently.")
+            return claim_slots(manager, *args)
+
+        with mock.patch.object(VoucherManager, '_claim_slots', taken_once):
+            self.assertEqual(Voucher.objects.redeem_many([self.single.code], self.users[0]), {self.single.code: None})
+        self.assertEqual(len(calls), 2)
+        self.single.refresh_from_db()
+        self.assertEqual(self.single.redeemed_count, 1)
+
+    def test_retries_are_bounded(self):
+        error = IntegrityError("A pending voucher user was redeemed concurrently.")
+        with mock.patch.object(VoucherManager, '_claim_slots', side_effect=error) as claim_slots:
+            with self.assertRaises(IntegrityError):
+                Voucher.objects.redeem_many([self.single.code], self.users[0])
+        self.assertEqual(claim_slots.call_count, REDEEM_RETRIES + 1)
+
+
+class RedeemSignalTestCase(TransactionTestCase):
+    def setUp(self):
+        self.received = []
+        self.batches = []
+        redeem_done.connect(self.receiver)
+        self.addCleanup(redeem_done.disconnect, self.receiver)
+        vouchers_redeemed.connect(self.batch_receiver)
+        self.addCleanup(vouchers_redeemed.disconnect, self.batch_receiver)
+
+    def receiver(self, sender, voucher, **kwargs):
+        self.received.append(voucher)
+
+    def batch_receiver(self, sender, vouchers, **kwargs):
+        self.batches.append(vouchers)
+
+    def test_signal_after_commit(self):
+        voucher = Voucher.objects.create_voucher('monetary', 100)
+        with transaction.atomic():
+            self.assertTrue(voucher.redeem())
+            self.assertEqual(self.received, [])
+        self.assertEqual(self.received, [voucher])
+        self.assertEqual(self.batches, [[voucher]])
+
+    def test_no_signal_on_failure(self):
+        voucher = Voucher.objects.create_voucher('monetary', 100)
+        voucher.redeem()
+        self.assertFalse(voucher.redeem())
+        self.assertEqual(self.received, [voucher])
+
+    def test_one_batch_signal_for_many(self):
+        vouchers = Voucher.objects.create_vouchers(3, 'monetary', 100)
+        user = User.objects.create(username="user")
+        Voucher.objects.redeem_many([voucher.code for voucher in vouchers], user)
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(self.batches[0], self.received)
+        # every voucher still gets its own ``redeem_done`` with a voucher instance
+        self.assertEqual(sorted(voucher.pk for voucher in self.received), sorted(voucher.pk for voucher in vouchers))
+        self.assertEqual(set(voucher.redeemed_count for voucher in self.received), {1})
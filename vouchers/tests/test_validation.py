@@ -0,0 +1,51 @@
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.utils import timezone
+from django.test import TestCase
+from vouchers.forms import VoucherForm
+from vouchers.models import Voucher, VoucherUser
+from vouchers.validation import validate_codes
+
+class ValidateCodesTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        other = User.objects.create(username="user2")
+        used = Voucher.objects.create_voucher('monetary', 100)
+        used.redeem(other)
+        used_by_user = Voucher.objects.create_voucher('monetary', 100, self.user, user_limit=2)
+        used_by_user.redeem(self.user)
+        bound_to_other = Voucher.objects.create_voucher('monetary', 100, other)
+        VoucherUser.objects.create(voucher=Voucher.objects.create_voucher('monetary', 100, user_limit=0))
+        self.codes = [voucher.code for voucher in Voucher.objects.order_by('pk')] + [
+            Voucher.objects.create_voucher('percentage', 10).code,
+            Voucher.objects.create_voucher('monetary', 100, valid_until=timezone.now() - timedelta(days=1)).code,
+            Voucher.objects.create_voucher('monetary', 100, user_limit=3).code,
+            "missing",
+        ]
+
+    def form_error(self, code, user, types):
+        form = VoucherForm(data={'code': code}, user=user, types=types)
+        return None if form.is_valid() else form.errors['code'][0]
+
+    def test_same_messages_as_form(self):
+        for user in (self.user, None):
+            results = validate_codes(self.codes, user, types=('monetary',))
+            self.assertEqual(list(results), self.codes)
+            for code in self.codes:
+                self.assertEqual(results[code], self.form_error(code, user, ('monetary',)))
+        self.assertEqual(len(set(validate_codes(self.codes, self.user, ('monetary',)).values())), 7)
+
+    def test_single_query(self):
+        with self.assertNumQueries(1):
+            validate_codes(self.codes[:1], self.user)
+        with self.assertNumQueries(1):
+            validate_codes(self.codes, self.user)
+        with self.assertNumQueries(0):
+            validate_codes([])
+
+    def test_redeem_many_uses_types(self):
+        code = self.codes[-4]
+        self.assertEqual(
+            Voucher.objects.redeem_many([code], self.user, types=('monetary',)),
+            {code: "This code is not meant to be used here."}
+        )
@@ -0,0 +1,75 @@
+import json
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from vouchers.models import Voucher
+
+class ApiTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.vouchers = Voucher.objects.create_vouchers(3, 'monetary', 100)
+        self.codes = [voucher.code for voucher in self.vouchers]
+
+    def test_validate(self):
+        self.client.force_login(self.user)
+        self.vouchers[0].redeem(self.user)
+        response = self.client.get(reverse('vouchers:validate'), {'code': self.codes + ["missing"]})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content.startswith(b'{"results":{'))
+        self.assertEqual(json.loads(response.content.decode())['results'], {
+            self.codes[0]: "This code has already been used.",
+            self.codes[1]: None,
+            self.codes[2]: None,
+            "missing": "This code is not valid.",
+        })
+
+    def test_validate_anonymous(self):
+        response = self.client.get(reverse('vouchers:validate'), {'code': self.codes[0]})
+        self.assertEqual(json.loads(response.content.decode())['results'], {self.codes[0]: None})
+        self.assertEqual(self.client.post(reverse('vouchers:validate')).status_code, 405)
+
+    def test_redeem(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('vouchers:redeem'), {'code': self.codes[:2]})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(json.loads(response.content.decode())['redeemed'])
+        self.assertEqual(Voucher.objects.filter(redeemed_count=1).count(), 2)
+
+        response = self.client.post(reverse('vouchers:redeem'), {'code': self.codes[1:]})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(response.content.decode()), {'redeemed': False, 'results': {
+            self.codes[1]: "This code has already been used.",
+            self.codes[2]: None,
+        }})
+        self.assertEqual(self.client.post(reverse('vouchers:redeem')).status_code, 400)
+
+    def test_status(self):
+        url = reverse('vouchers:status', args=[self.codes[0]])
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content.decode())
+        self.assertEqual((data['code'], data['redeemed_count'], data['redeemed']), (self.codes[0], 0, False))
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.vouchers[0].redeem(self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(json.loads(response.content.decode())['redeemed'])
+
+    def test_status_missing(self):
+        response = self.client.get(reverse('vouchers:status', args=["missing"]))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json.loads(response.content.decode()), {'error': "This code is not valid."})
+
+    def test_status_rejected_without_lookup(self):
+        with mock.patch('vouchers.views.is_acceptable', return_value=False), \
+                mock.patch('vouchers.views.get_voucher') as get_voucher, self.assertNumQueries(0):
+            response = self.client.get(reverse('vouchers:status', args=[self.codes[0]]))
+        self.assertEqual(response.status_code, 404)
+        with mock.patch('vouchers.views.might_exist', return_value=False), self.assertNumQueries(0):
+            response = self.client.get(reverse('vouchers:status', args=[self.codes[0]]))
+        self.assertEqual(response.status_code, 404)
+        get_voucher.assert_not_called()
@@ -0,0 +1,12 @@
+from django.conf.urls import url
+
+from . import views
+
+app_name = 'vouchers'
+
+urlpatterns = [
+    url(r'^validate/$', views.validate, name='validate'),
+    url(r'^redeem/$', views.redeem, name='redeem'),
+    url(r'^status/(?P<code>[^/]+)/$', views.status, name='status'),
+    url(r'^metrics/$', views.metrics, name='metrics'),
+]
@@ -0,0 +1,102 @@
+from collections import OrderedDict
+
+from django.utils.translation import ugettext_lazy as _
+
+from . import metrics
+from .bloom import might_exist
+from .codes import is_acceptable
+from .profiling import profiled
+from .settings import ARCHIVE_LOOKUP
+
+INVALID = _("This code is not valid.")
+USER_REQUIRED = _(
+    "The server must provide an user to this form to allow you to use this code. Maybe you need to sign in?"
+)
+USED = _("This code has already been used.")
+USED_BY_USER = _("This code has already been used by your account.")
+NOT_FOR_USER = _("This code is not valid for your account.")
+WRONG_TYPE = _("This code is not meant to be used here.")
+EXPIRED = _("This code is expired.")
+
+# metric labels of the messages, compared by identity because lazy messages are not hashable
+OUTCOMES = (
+    (INVALID, 'invalid'),
+    (USER_REQUIRED, 'user_required'),
+    (USED, 'used'),
+    (USED_BY_USER, 'used_by_user'),
+    (NOT_FOR_USER, 'not_for_user'),
+    (WRONG_TYPE, 'wrong_type'),
+    (EXPIRED, 'expired'),
+)
+
+
+def outcome(error):
+    """ Returns the metric label of ``error`` as returned by ``voucher_error``. """
+    for message, name in OUTCOMES:
+        if error is message:
+            return name
+    return 'valid' if error is None else 'other'
+
+
+def count_outcome(error):
+    metrics.inc('vouchers_validations_total', (('outcome', outcome(error)),))
+
+
+def voucher_error(voucher, user=None, types=None):
+    """ Returns why ``user`` cannot redeem ``voucher`` annotated by ``with_user_state``, or ``None``. """
+    if voucher is None:
+        return INVALID
+    if user is None and voucher.user_limit != 1:
+        # vouchers with can be used only once can be used without tracking the user, otherwise there is no chance
+        # of excluding an unknown user from multiple usages.
+        return USER_REQUIRED
+    if voucher.is_redeemed:
+        return USED
+    if voucher.user_bound:  # there is a user bound voucher existing
+        if voucher.user_redeemed:
+            return USED_BY_USER
+    elif voucher.user_limit != 0:  # zero means no limit of user count
+        # only user bound vouchers left and you don't have one
+        if voucher.user_limit == voucher.bound_user_count:
+            return NOT_FOR_USER
+        if voucher.user_limit == voucher.redeemed_count:  # all vouchers redeemed
+            return USED
+    if types is not None and voucher.type not in types:
+        return WRONG_TYPE
+    if voucher.expired():
+        return EXPIRED
+    return None
+
+
+def archived_errors(codes):
+    """ Returns the error of every archived code in ``codes``, telling used and expired codes apart. """
+    from .models import ArchivedVoucher, Voucher  # the models use the rules of this module
+
+    if not codes:
+        return {}
+    statuses = ArchivedVoucher.objects.filter(code__in=codes).values_list('code', 'status')
+    return dict((code, EXPIRED if status == Voucher.EXPIRED else USED) for code, status in statuses)
+
+
+@metrics.timed('validate_codes')
+@profiled('validate_codes')
+def validate_codes(codes, user=None, types=None):
+    """ Checks ``codes`` like ``VoucherForm`` does, with one query for the whole list.
+
+    Returns a dict mapping every code to ``None`` if ``user`` may redeem it, or to the form's error message. With
+    ``VOUCHERS_ARCHIVE_LOOKUP`` a second query looks up the codes missing from the live table in the archive.
+    """
+    from .models import Voucher  # the models use the rules of this module
+
+    codes = list(OrderedDict.fromkeys(codes))
+    candidates = [code for code in codes if is_acceptable(code) and might_exist(code)]
+    vouchers = {}
+    if candidates:
+        vouchers = dict(
+            (voucher.code, voucher) for voucher in Voucher.objects.with_user_state(user).filter(code__in=candidates))
+    results = OrderedDict((code, voucher_error(vouchers.get(code), user, types)) for code in codes)
+    if ARCHIVE_LOOKUP:
+        results.update(archived_errors([code for code in candidates if code not in vouchers]))
+    for error in results.values():
+        count_outcome(error)
+    return results
@@ -0,0 +1,96 @@
+""" A small JSON API for storefronts, which skips the form and template stack of ``VoucherForm``.
+
+The responses are compact JSON. Query counts exclude the session and user lookups of the authentication middleware,
+which only run when a view needs ``request.user``.
+"""
+import hashlib
+import json
+
+from django.http import Http404, HttpResponse, JsonResponse
+from django.views.decorators.http import condition, require_GET, require_POST
+
+from . import metrics as voucher_metrics
+from .bloom import might_exist
+from .cache import get_voucher
+from .codes import is_acceptable
+from .models import Voucher
+from .validation import INVALID, validate_codes
+
+JSON_OPTIONS = {'separators': (',', ':')}
+
+
+def json_response(data, status=200):
+    return JsonResponse(data, status=status, json_dumps_params=JSON_OPTIONS)
+
+
+def get_user(request):
+    return request.user if request.user.is_authenticated else None
+
+
+@require_GET
+def validate(request):
+    """ ``GET ?code=A&code=B[&type=T]`` returns ``{"results": {code: null or error}}`` with one query. """
+    codes = request.GET.getlist('code')
+    types = request.GET.getlist('type') or None
+    return json_response({'results': validate_codes(codes, get_user(request), types)})
+
+
+@require_POST
+def redeem(request):
+    """ ``POST code=A&code=B[&type=T]`` redeems all codes or none, with at most seven queries.
+
+    Answers ``200`` with ``{"redeemed": true, "results": ...}`` or ``409`` if one of the codes cannot be redeemed.
+    """
+    codes = request.POST.getlist('code')
+    if not codes:
+        return json_response({'error': INVALID}, status=400)
+    results = Voucher.objects.redeem_many(codes, get_user(request), request.POST.getlist('type') or None)
+    redeemed = not any(results.values())
+    return json_response({'redeemed': redeemed, 'results': results}, status=200 if redeemed else 409)
+
+
+def status_body(request, code):
+    """ Serializes the voucher once per request, for the ETag and the response. """
+    if not hasattr(request, '_voucher_status'):
+        # forged and unknown codes are turned away without a cache or database lookup, like in ``VoucherForm``
+        voucher = get_voucher(code) if is_acceptable(code) and might_exist(code) else None
+        body = None
+        if voucher is not None:
+            body = json.dumps({
+                'code': voucher.code,
+                'type': voucher.type,
+                'value': voucher.value,
+                'valid_until': voucher.valid_until.isoformat() if voucher.valid_until else None,
+                'user_limit': voucher.user_limit,
+                'redeemed_count': voucher.redeemed_count,
+                'redeemed': voucher.is_redeemed,
+                'expired': voucher.expired(),
+            }, **JSON_OPTIONS)
+        request._voucher_status = body
+    return request._voucher_status
+
+
+def status_etag(request, code):
+    body = status_body(request, code)
+    return body and hashlib.md5(body.encode('utf-8')).hexdigest()
+
+
+@require_GET
+@condition(etag_func=status_etag)
+def status(request, code):
+    """ ``GET <code>/`` returns the public state of a voucher with one query, none with a warm voucher cache.
+
+    Clients sending the ETag in ``If-None-Match`` receive ``304`` while the voucher is unchanged.
+    """
+    body = status_body(request, code)
+    if body is None:
+        return json_response({'error': INVALID}, status=404)
+    return HttpResponse(body, content_type='application/json')
+
+
+@require_GET
+def metrics(request):
+    """ ``GET`` returns the counters and latency histograms of all workers in the Prometheus text format. """
+    if not voucher_metrics.METRICS:
+        raise Http404("Voucher metrics are turned off.")
+    return HttpResponse(voucher_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')